@@ -0,0 +1,94 @@
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+
+class TokenCache:
+    '''Пользователь по ключу токена.
+
+    В памяти процесса запись живёт TOKEN_CACHE_LOCAL_TIMEOUT секунд, в
+    общем кэше settings.TOKEN_CACHE - TOKEN_CACHE_TIMEOUT. Отозванный
+    ключ в общем кэше заменяется отметкой, которую не перезапишет
+    запрос, прочитавший базу до отзыва. Другие процессы перестанут
+    пускать по нему не позже, чем истечёт их локальная запись.
+    '''
+    revoked = 'revoked'
+
+    def __init__(self):
+        self.local = OrderedDict()
+        self.lock = threading.Lock()
+
+    @property
+    def cache(self):
+        if not settings.TOKEN_CACHE:
+            return None
+        return caches[settings.TOKEN_CACHE]
+
+    def make_key(self, key):
+        # Ключи токенов в общий кэш не попадают.
+        return f'auth-token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+    def get(self, key):
+        with self.lock:
+            entry = self.local.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.local.move_to_end(key)
+                return copy.copy(entry[1])
+        if self.cache is None:
+            return None
+        user = self.cache.get(self.make_key(key))
+        if user is None or user == self.revoked:
+            return None
+        self.set_local(key, user)
+        return copy.copy(user)
+
+    def set(self, key, user):
+        if self.cache is not None and not self.cache.add(
+            self.make_key(key), user, settings.TOKEN_CACHE_TIMEOUT
+        ):
+            return
+        self.set_local(key, user)
+
+    def set_local(self, key, user):
+        with self.lock:
+            self.local[key] = (
+                time.monotonic() + settings.TOKEN_CACHE_LOCAL_TIMEOUT, user
+            )
+            self.local.move_to_end(key)
+            while len(self.local) > settings.TOKEN_CACHE_LOCAL_SIZE:
+                self.local.popitem(last=False)
+
+    def revoke(self, keys):
+        with self.lock:
+            for key in keys:
+                self.local.pop(key, None)
+        if self.cache is not None:
+            self.cache.set_many(
+                {self.make_key(key): self.revoked for key in keys},
+                settings.TOKEN_CACHE_REVOKED_TIMEOUT,
+            )
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    '''TokenAuthentication без запроса к базе, пока токен в кэше'''
+
+    def authenticate_credentials(self, key):
+        user = token_cache.get(key)
+        if user is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, user)
+            return user, token
+        if not user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        return user, self.get_model()(key=key, user=user)
@@ -0,0 +1,70 @@
+import bisect
+import threading
+
+from django.conf import settings
+
+from recipes.models import Ingredients
+from .cache import ingredients_cache
+
+
+def normalize(value):
+    '''Регистр не важен, а «ё» и «е» считаются одной буквой'''
+    return value.strip().casefold().replace('ё', 'е')
+
+
+class IngredientIndex:
+    '''Отсортированный индекс названий ингредиентов в памяти процесса.
+
+    Пересобирается, когда меняется версия справочника ингредиентов в
+    ingredients_cache, то есть после любого сохранения или удаления.
+    '''
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.version = None
+        # Названия и строки ответа публикуются одним присваиванием:
+        # поиск не увидит новые названия со старыми строками.
+        self.entries = ([], [])
+        self.lock = threading.Lock()
+
+    def build(self):
+        rows = sorted(
+            (normalize(row['name']), row['id'], row)
+            for row in Ingredients.objects.values(
+                'id', 'name', 'measurement_unit'
+            )
+        )
+        return (
+            [name for name, _, _ in rows], [row for _, _, row in rows]
+        )
+
+    def refresh(self):
+        version = self.cache.get_version()
+        if version != self.version:
+            with self.lock:
+                if version != self.version:
+                    self.entries = self.build()
+                    self.version = version
+
+    def search(self, query, limit=None):
+        '''Строки ответа: сначала начинающиеся с query, затем содержащие.
+
+        Не больше limit (по умолчанию INGREDIENT_SEARCH_LIMIT), поиск
+        подстроки останавливается, как только их набралось достаточно.
+        '''
+        self.refresh()
+        limit = limit or settings.INGREDIENT_SEARCH_LIMIT
+        query = normalize(query)
+        names, rows = self.entries
+        start = bisect.bisect_left(names, query)
+        end = bisect.bisect_left(names, query + '\U0010ffff', start)
+        found = rows[start:min(end, start + limit)]
+        for position, name in enumerate(names):
+            if len(found) >= limit:
+                break
+            if query in name and not start <= position < end:
+                found.append(rows[position])
+        return found
+
+
+ingredient_index = IngredientIndex(ingredients_cache)
@@ -0,0 +1,430 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from recipes.models import Favorite, ShoppingCart
+from users.models import Follow
+
+
+class DictionaryCache:
+    '''Версионированный кэш ответов справочника.
+
+    Версия - время последнего изменения в миллисекундах - хранится в общем
+    кэше settings.DICTIONARY_CACHE, ответы - в памяти процесса и в общем
+    кэше под ключом с версией. Смена версии разом делает все ответы
+    устаревшими, поэтому удалять их не нужно.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.version_key = f'dictionary:{name}:version'
+        self.local = OrderedDict()
+
+    @property
+    def cache(self):
+        return caches[settings.DICTIONARY_CACHE]
+
+    def get_version(self):
+        version = self.cache.get(self.version_key)
+        if version is None:
+            version = time.time_ns() // 1_000_000
+            if not self.cache.add(self.version_key, version, None):
+                version = self.cache.get(self.version_key, version)
+        return version
+
+    def invalidate(self):
+        version = max(
+            time.time_ns() // 1_000_000,
+            (self.cache.get(self.version_key) or 0) + 1,
+        )
+        self.cache.set(self.version_key, version, None)
+        self.local.clear()
+
+    def make_key(self, version, key):
+        return f'dictionary:{self.name}:{version}:{self.digest(key)}'
+
+    def digest(self, key):
+        return hashlib.md5(key.encode()).hexdigest()
+
+    def get(self, version, key):
+        cache_key = self.make_key(version, key)
+        if cache_key in self.local:
+            return self.local[cache_key]
+        data = self.cache.get(cache_key)
+        if data is not None:
+            self.set_local(cache_key, data)
+        return data
+
+    def set(self, version, key, data):
+        cache_key = self.make_key(version, key)
+        self.cache.set(cache_key, data, settings.DICTIONARY_CACHE_TIMEOUT)
+        self.set_local(cache_key, data)
+
+    def set_local(self, cache_key, data):
+        self.local[cache_key] = data
+        while len(self.local) > settings.DICTIONARY_CACHE_LOCAL_SIZE:
+            self.local.popitem(last=False)
+
+    def etag(self, version, key):
+        return f'"{self.name}-{version}-{self.digest(key)}"'
+
+
+tags_cache = DictionaryCache('tags')
+ingredients_cache = DictionaryCache('ingredients')
+
+
+class CachedDictionaryMixin:
+    '''Отдаёт справочник из кэша и отвечает 304 по ETag/Last-Modified'''
+    dictionary_cache = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        cache = self.dictionary_cache
+        version = cache.get_version()
+        key = f'{request.accepted_media_type}:{request.get_full_path()}'
+        headers = HttpResponse()
+        headers['ETag'] = cache.etag(version, key)
+        headers['Last-Modified'] = http_date(version / 1000)
+        patch_vary_headers(headers, ('Accept',))
+        not_modified = get_conditional_response(
+            request,
+            etag=headers['ETag'],
+            last_modified=version // 1000,
+            response=headers,
+        )
+        if not_modified is not headers:
+            return not_modified
+        data = cache.get(version, key)
+        if data is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            data = response.data
+            cache.set(version, key, data)
+        response = Response(data)
+        for header in ('ETag', 'Last-Modified', 'Vary'):
+            response[header] = headers[header]
+        return response
+
+
+class RecipeResponseCache:
+    '''Ответы списка и страницы рецепта для анонимов.
+
+    Ответ зависит от рецептов и авторов в нём и от выборки: все рецепты,
+    рецепты автора или тега, поле сортировки. У каждой зависимости своя
+    версия в общем кэше, запись помнит версии на момент сборки и
+    устаревает, если хоть одна сменилась. Поэтому изменение рецепта
+    сбрасывает только ответы, где он есть или может появиться.
+    '''
+    changes = 'changes'
+
+    @property
+    def cache(self):
+        return caches[settings.DICTIONARY_CACHE]
+
+    def version_key(self, dependency):
+        return f'recipes:version:{dependency}'
+
+    def make_key(self, key):
+        return f'recipes:response:{hashlib.md5(key.encode()).hexdigest()}'
+
+    def invalidate(self, *dependencies):
+        '''Версии меняются после коммита, иначе ответ соберут по старым
+        данным и запомнят с новыми версиями'''
+        transaction.on_commit(partial(self.bump, dependencies))
+
+    def invalidate_lists(self, authors=(), tags=()):
+        self.invalidate(
+            'recipes', 'content',
+            *(f'author-recipes:{author}' for author in authors),
+            *(f'tag-recipes:{slug}' for slug in tags),
+        )
+
+    def bump(self, dependencies):
+        version = time.time_ns()
+        self.cache.set_many(
+            {
+                self.version_key(dependency): version
+                for dependency in (*dependencies, self.changes)
+            },
+            None,
+        )
+
+    def versions(self, dependencies):
+        keys = [self.version_key(dependency) for dependency in dependencies]
+        versions = self.cache.get_many(keys)
+        for key in keys:
+            if key not in versions:
+                version = time.time_ns()
+                if not self.cache.add(key, version, None):
+                    version = self.cache.get(key, version)
+                versions[key] = version
+        return versions
+
+    def get(self, key):
+        entry = self.cache.get(self.make_key(key))
+        if entry is None:
+            return None
+        if self.cache.get_many(entry['versions']) != entry['versions']:
+            return None
+        return entry['data']
+
+    def set(self, key, started, dependencies, data):
+        '''started - версии выборки, прочитанные до сборки ответа'''
+        versions = self.versions((*dependencies, self.changes))
+        changes = self.version_key(self.changes)
+        # Пока ответ собирался, что-то поменялось: версии рецептов
+        # могли смениться раньше, чем их прочитали.
+        if versions.pop(changes) != started.pop(changes):
+            return
+        self.cache.set(
+            self.make_key(key),
+            {'versions': {**started, **versions}, 'data': data},
+            settings.RECIPE_CACHE_TIMEOUT,
+        )
+
+
+recipe_cache = RecipeResponseCache()
+
+
+class MembershipCache:
+    '''Избранное, корзина и подписки пользователя множествами id.
+
+    Множества хранятся в памяти процесса для MEMBERSHIP_CACHE_SIZE
+    пользователей, давно не нужные вытесняются первыми. Версия
+    пользователя в общем кэше растёт на единицу с каждым изменением:
+    процесс дописывает изменение в свою копию, только если версия
+    выросла ровно на единицу, иначе он пропустил чужое и перечитает
+    базу. Изменения в обход API подтянутся через
+    MEMBERSHIP_CACHE_TIMEOUT секунд.
+    '''
+    fields = {
+        Favorite: 'recipes_id',
+        ShoppingCart: 'recipes_id',
+        Follow: 'author_id',
+    }
+
+    def __init__(self):
+        self.local = OrderedDict()
+        self.lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[settings.DICTIONARY_CACHE]
+
+    def version_key(self, user_id):
+        return f'memberships:{user_id}:version'
+
+    def get_version(self, user_id):
+        key = self.version_key(user_id)
+        version = self.cache.get(key)
+        if version is None:
+            version = time.time_ns()
+            if not self.cache.add(key, version, None):
+                version = self.cache.get(key, version)
+        return version
+
+    def load(self, user_id):
+        return {
+            model: set(model.objects.filter(
+                user_id=user_id
+            ).values_list(field, flat=True))
+            for model, field in self.fields.items()
+        }
+
+    def get(self, user_id):
+        version = self.get_version(user_id)
+        with self.lock:
+            entry = self.local.get(user_id)
+            if (
+                entry is not None and entry[0] == version
+                and entry[1] > time.monotonic()
+            ):
+                self.local.move_to_end(user_id)
+                return entry[2]
+        memberships = self.load(user_id)
+        with self.lock:
+            self.local[user_id] = (
+                version,
+                time.monotonic() + settings.MEMBERSHIP_CACHE_TIMEOUT,
+                memberships,
+            )
+            self.local.move_to_end(user_id)
+            while len(self.local) > settings.MEMBERSHIP_CACHE_SIZE:
+                self.local.popitem(last=False)
+        return memberships
+
+    def for_request(self, request):
+        '''Множества пользователя запроса, версия читается один раз'''
+        if not request.user.is_authenticated:
+            return None
+        memberships = getattr(request, 'memberships', None)
+        if memberships is None:
+            memberships = request.memberships = self.get(request.user.pk)
+        return memberships
+
+    def contains(self, request, model, pk):
+        memberships = self.for_request(request)
+        return memberships is not None and pk in memberships[model]
+
+    def add(self, user, model, ids):
+        self.change(user.pk, model, ids, True)
+
+    def remove(self, user, model, ids):
+        self.change(user.pk, model, ids, False)
+
+    def change(self, user_id, model, ids, added):
+        ids = {int(pk) for pk in ids}
+        if ids:
+            transaction.on_commit(
+                partial(self.apply, user_id, model, ids, added)
+            )
+
+    def apply(self, user_id, model, ids, added):
+        try:
+            version = self.cache.incr(self.version_key(user_id))
+        except ValueError:
+            # Версию вытеснили: новая не совпадёт ни с одной копией.
+            version = None
+        with self.lock:
+            entry = self.local.pop(user_id, None)
+            if version is None or entry is None or entry[0] != version - 1:
+                return
+            if added:
+                entry[2][model].update(ids)
+            else:
+                entry[2][model].difference_update(ids)
+            self.local[user_id] = (version, entry[1], entry[2])
+
+
+membership_cache = MembershipCache()
+
+
+class CachedRecipesMixin:
+    '''Анонимный ответ из кэша, пользователю - он же с его флагами.
+
+    Фильтры по избранному и корзине зависят от пользователя, с ними
+    и с незнакомыми параметрами ответ собирается как обычно.
+    '''
+    ordering_fields = {}
+    scope_filters = ('author', 'tags')
+    content_filters = ('search', 'have')
+    user_filters = ('is_favorited', 'is_in_shopping_cart')
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def get_cache_params(self, request):
+        paginator = self.paginator
+        allowed = set(self.filterset_class.base_filters) - set(
+            self.user_filters
+        ) | {
+            paginator.page_query_param,
+            paginator.page_size_query_param,
+            paginator.cursor_query_param,
+        }
+        params = request.query_params
+        if not set(params) <= allowed:
+            return None
+        return params
+
+    def get_scope(self, params):
+        '''Выборки, от которых зависит состав ответа'''
+        if self.action == 'retrieve':
+            return []
+        scope = [
+            f'author-recipes:{author}' for author in params.getlist('author')
+        ] + [f'tag-recipes:{slug}' for slug in params.getlist('tags')]
+        if not scope:
+            scope.append('recipes')
+        if any(name in params for name in self.content_filters):
+            scope.append('content')
+        scope.extend(
+            f'field:{field.lstrip("-")}'
+            for field in self.ordering_fields.get(params.get('ordering'), ())
+        )
+        return scope
+
+    def get_items(self, data):
+        return data['results'] if 'results' in data else [data]
+
+    def get_dependencies(self, data):
+        dependencies = set()
+        for item in self.get_items(data):
+            dependencies.add(f'recipe:{item["id"]}')
+            dependencies.add(f'author:{item["author"]["id"]}')
+        return dependencies
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        params = self.get_cache_params(request)
+        if params is None:
+            return handler(request, *args, **kwargs)
+        key = ':'.join((
+            self.action,
+            str(kwargs.get(self.lookup_field, '')),
+            request.accepted_media_type,
+            request.build_absolute_uri('/'),
+            '&'.join(
+                f'{name}={",".join(sorted(params.getlist(name)))}'
+                for name in sorted(params)
+            ),
+        ))
+        data = recipe_cache.get(key)
+        if data is None:
+            started = recipe_cache.versions(
+                (*self.get_scope(params), recipe_cache.changes)
+            )
+            started[tags_cache.version_key] = tags_cache.get_version()
+            started[ingredients_cache.version_key] = (
+                ingredients_cache.get_version()
+            )
+            user = request.user
+            request.user = AnonymousUser()
+            try:
+                response = handler(request, *args, **kwargs)
+            finally:
+                request.user = user
+            if response.status_code != 200:
+                return response
+            data = response.data
+            recipe_cache.set(
+                key, started, self.get_dependencies(data), data
+            )
+        if request.user.is_authenticated:
+            self.overlay(data, request)
+        return Response(data)
+
+    def overlay(self, data, request):
+        '''Флаги пользователя из его множеств, без запросов к базе'''
+        memberships = membership_cache.for_request(request)
+        for item in self.get_items(data):
+            item['is_favorited'] = item['id'] in memberships[Favorite]
+            item['is_in_shopping_cart'] = (
+                item['id'] in memberships[ShoppingCart]
+            )
+            item['author']['is_subscribed'] = (
+                item['author']['id'] in memberships[Follow]
+            )
@@ -1,20 +1,46 @@
+from django.conf import settings
+from django.db.models import Case, FloatField, When
 from django_filters import rest_framework as filters
 
 from recipes.models import (Ingredients, Recipes, Tags)
+from .autocomplete import ingredient_index
+from .matching import ingredient_matcher
+from .search import get_search_backend
 
 CHOICES_LIST = (
     ('0', 'False'),
     ('1', 'True')
 )
+ORDERINGS = {
+    'new': ('-pub_date', '-id'),
+    'popular': ('-favorites_count', '-pub_date', '-id'),
+    'trending': ('-trending_score', '-pub_date', '-id'),
+}
+ORDERING_CHOICES = (
+    ('new', 'Новые'),
+    ('popular', 'Популярные'),
+    ('trending', 'Популярные за последние дни'),
+)
+
+
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    pass
 
 
 class IngredientsFilter(filters.FilterSet):
-    name = filters.CharFilter(lookup_expr='istartswith')
+    name = filters.CharFilter(method='get_filter_by_name')
 
     class Meta:
         model = Ingredients
         fields = ('name',)
 
+    def get_filter_by_name(self, queryset, name, value):
+        '''Тот же поиск по индексу; список с name отдаёт
+        IngredientsViewSet прямо из индекса, без запроса к базе'''
+        return queryset.filter(pk__in=[
+            row['id'] for row in ingredient_index.search(value)
+        ])
+
 
 class RecipeFilter(filters.FilterSet):
     tags = filters.ModelMultipleChoiceFilter(
@@ -26,10 +52,21 @@ class RecipeFilter(filters.FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_filter_is_in_shopping_cart'
     )
+    search = filters.CharFilter(method='get_filter_search')
+    have = NumberInFilter(method='get_filter_have')
+    missing = filters.NumberFilter(
+        method='get_filter_missing', min_value=0
+    )
+    ordering = filters.ChoiceFilter(
+        choices=ORDERING_CHOICES, method='get_filter_ordering'
+    )
 
     class Meta:
         model = Recipes
-        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
+        fields = (
+            'tags', 'author', 'is_favorited', 'is_in_shopping_cart',
+            'search', 'have', 'missing', 'ordering',
+        )
 
     def get_filter_is_favorited(self, queryset, name, value):
         user = self.request.user
@@ -42,3 +79,36 @@ class RecipeFilter(filters.FilterSet):
         if value and user.is_authenticated:
             return queryset.filter(shopping_cart__user=user)
         return queryset
+
+    def get_filter_search(self, queryset, name, value):
+        return get_search_backend().search(queryset, value)
+
+    def get_filter_have(self, queryset, name, value):
+        '''Рецепты из имеющихся ингредиентов, по доле покрытия'''
+        missing = self.form.cleaned_data.get('missing')
+        matches = ingredient_matcher.match(
+            [int(pk) for pk in value],
+            settings.MATCH_MAX_MISSING if missing is None else int(missing),
+            settings.MATCH_RESULTS_LIMIT,
+        )
+        if not matches:
+            return queryset.none()
+        return queryset.filter(
+            pk__in=[recipe_id for recipe_id, _ in matches]
+        ).annotate(
+            coverage=Case(
+                *(
+                    When(pk=recipe_id, then=coverage)
+                    for recipe_id, coverage in matches
+                ),
+                output_field=FloatField(),
+            )
+        ).order_by('-coverage', '-pub_date', '-id')
+
+    def get_filter_missing(self, queryset, name, value):
+        '''Учитывается в get_filter_have'''
+        return queryset
+
+    def get_filter_ordering(self, queryset, name, value):
+        '''Сортировка по заранее посчитанным колонкам с индексами'''
+        return queryset.order_by(*ORDERINGS[value])
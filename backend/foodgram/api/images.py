@@ -0,0 +1,283 @@
+import base64
+import binascii
+import io
+import logging
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import filetype
+from django.apps import apps
+from django.conf import settings
+from django.core.files.uploadedfile import (
+    InMemoryUploadedFile, TemporaryUploadedFile
+)
+from django.db import connections
+from drf_extra_fields.fields import Base64FieldMixin, Base64ImageField
+from PIL import Image, ImageOps, features
+from rest_framework import serializers
+
+# Модуль импортируется процессами пула, где Django не настроен,
+# поэтому модели здесь берутся через apps.get_model внутри функций.
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+SAVE_OPTIONS = {
+    'WEBP': {'method': 4},
+    'JPEG': {'optimize': True, 'progressive': True},
+}
+SNIFF_SIZE = 262
+
+_executor = None
+
+
+def get_format():
+    image_format = settings.IMAGE_RENDITION_FORMAT
+    if image_format == 'WEBP' and not features.check('webp'):
+        return 'JPEG'
+    return image_format
+
+
+def get_storage():
+    recipes = apps.get_model('recipes', 'Recipes')
+    return recipes._meta.get_field('image').storage
+
+
+def rendition_name(name, rendition, image_format):
+    stem, _ = os.path.splitext(name)
+    return f'{stem}_{rendition}.{EXTENSIONS[image_format]}'
+
+
+def rendition_names(name):
+    '''Все возможные превью файла, в любом из форматов'''
+    return [
+        rendition_name(name, rendition, image_format)
+        for rendition in settings.IMAGE_RENDITIONS
+        for image_format in EXTENSIONS
+    ]
+
+
+def render_renditions(source, targets, image_format, quality):
+    '''Ресайз и пережатие, выполняется в процессе пула'''
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert(
+                'RGBA' if 'transparency' in image.info else 'RGB'
+            )
+        if image_format == 'JPEG' and image.mode != 'RGB':
+            image = image.convert('RGB')
+        for path, size in targets:
+            rendition = image.copy()
+            rendition.thumbnail(size, Image.LANCZOS)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Через временный файл, чтобы nginx не отдал недописанное превью.
+            temporary = f'{path}.{uuid.uuid4().hex}.tmp'
+            rendition.save(
+                temporary, image_format, quality=quality,
+                **SAVE_OPTIONS.get(image_format, {})
+            )
+            os.replace(temporary, path)
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        # spawn, а не fork: в gthread-воркере форк может унести
+        # в дочерний процесс чужие захваченные блокировки.
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.IMAGE_PIPELINE_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+    return _executor
+
+
+def save_renditions(recipe_id, name, renditions):
+    '''Запоминает превью, если картинку рецепта ещё не успели заменить'''
+    # Модуль загружается и в процессах пула, где приложения не готовы.
+    from .cache import recipe_cache
+    recipes = apps.get_model('recipes', 'Recipes')
+    if recipes.objects.filter(pk=recipe_id, image=name).update(
+        image_renditions={'source': name, **renditions}
+    ):
+        recipe_cache.invalidate(f'recipe:{recipe_id}')
+
+
+def on_rendered(recipe_id, name, renditions, future):
+    # Колбэк работает в служебном потоке пула, соединение с базой
+    # этого потока закрывается сразу после записи.
+    try:
+        future.result()
+        save_renditions(recipe_id, name, renditions)
+    except Exception:
+        logger.exception('Не удалось построить превью для %s', name)
+    finally:
+        connections.close_all()
+
+
+def rendition_job(name):
+    '''Имена превью и аргументы для render_renditions'''
+    storage = get_storage()
+    image_format = get_format()
+    renditions = {
+        rendition: rendition_name(name, rendition, image_format)
+        for rendition in settings.IMAGE_RENDITIONS
+    }
+    arguments = (
+        storage.path(name),
+        [
+            (storage.path(renditions[rendition]), size)
+            for rendition, size in settings.IMAGE_RENDITIONS.items()
+        ],
+        image_format,
+        settings.IMAGE_RENDITION_QUALITY,
+    )
+    return renditions, arguments
+
+
+def schedule_renditions(recipe_id, name):
+    '''Ставит построение превью картинки рецепта в очередь.
+
+    Вызывается после коммита: ошибка здесь не должна превращать
+    сохранённый рецепт в ответ 500, рецепт остаётся без превью, как и
+    при ошибке в on_rendered.
+    '''
+    try:
+        renditions, arguments = rendition_job(name)
+        storage = get_storage()
+        # Одинаковые картинки хранятся одним файлом, превью для него
+        # могли уже построить для другого рецепта.
+        if all(
+            storage.exists(rendition) for rendition in renditions.values()
+        ):
+            save_renditions(recipe_id, name, renditions)
+            return
+        if settings.IMAGE_PIPELINE_WORKERS <= 0:
+            render_renditions(*arguments)
+            save_renditions(recipe_id, name, renditions)
+            return
+        future = get_executor().submit(render_renditions, *arguments)
+    except Exception:
+        logger.exception('Не удалось построить превью для %s', name)
+        return
+    future.add_done_callback(
+        partial(on_rendered, recipe_id, name, renditions)
+    )
+
+
+def release_image(name):
+    '''Удаляет файл и превью, если на него не ссылается ни один рецепт'''
+    recipes = apps.get_model('recipes', 'Recipes')
+    storage = get_storage()
+    if not name or recipes.objects.filter(image=name).exists():
+        return
+    if storage.is_fresh(name):
+        return
+    storage.delete_blob(name, rendition_names(name))
+
+
+def renditions_ready(recipe):
+    return recipe.image_renditions.get('source') == recipe.image.name
+
+
+def rendition_urls(recipe, request=None):
+    '''Ссылки на превью, пока их нет - на оригинал'''
+    if not recipe.image:
+        return {}
+    ready = renditions_ready(recipe)
+    urls = {}
+    for rendition in settings.IMAGE_RENDITIONS:
+        if ready:
+            url = recipe.image.storage.url(
+                recipe.image_renditions[rendition]
+            )
+        else:
+            url = recipe.image.url
+        urls[rendition] = (
+            request.build_absolute_uri(url) if request is not None else url
+        )
+    return urls
+
+
+class StreamingBase64ImageField(Base64ImageField):
+    '''Base64ImageField с декодированием по кускам во временный файл'''
+
+    def to_internal_value(self, base64_data):
+        if base64_data in self.EMPTY_VALUES:
+            return None
+        if not isinstance(base64_data, str):
+            return super().to_internal_value(base64_data)
+        content_type = None
+        if ';base64,' in base64_data:
+            header, base64_data = base64_data.split(';base64,', 1)
+            if self.trust_provided_content_type:
+                content_type = header.replace('data:', '')
+        upload = self.decode(base64_data, content_type)
+        upload.name = '.'.join((
+            self.get_file_name(None), self.sniff_extension(upload)
+        ))
+        # Минуем Base64FieldMixin: файл уже декодирован.
+        return super(Base64FieldMixin, self).to_internal_value(upload)
+
+    def decode(self, data, content_type):
+        if not data.isascii():
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        if any(char.isspace() for char in data[:SNIFF_SIZE]):
+            data = ''.join(data.split())
+        size = len(data) // 4 * 3
+        if size > settings.IMAGE_MAX_UPLOAD_SIZE:
+            raise serializers.ValidationError(settings.IMAGE_TOO_LARGE_ERROR)
+        if size > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+            upload = TemporaryUploadedFile('image', content_type, 0, None)
+        else:
+            upload = InMemoryUploadedFile(
+                io.BytesIO(), None, 'image', content_type, 0, None
+            )
+        # Кусок кратен четырём символам, поэтому декодируется независимо.
+        chunk_size = settings.IMAGE_DECODE_CHUNK_SIZE // 4 * 4
+        try:
+            for start in range(0, len(data), chunk_size):
+                upload.write(base64.b64decode(
+                    data[start:start + chunk_size], validate=True
+                ))
+        except (binascii.Error, ValueError):
+            upload.close()
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        upload.size = upload.tell()
+        upload.seek(0)
+        return upload
+
+    def sniff_extension(self, upload):
+        extension = filetype.guess_extension(upload.read(SNIFF_SIZE))
+        upload.seek(0)
+        if extension is None:
+            try:
+                with Image.open(upload) as image:
+                    extension = image.format.lower()
+            except OSError:
+                raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+            finally:
+                upload.seek(0)
+        extension = 'jpg' if extension == 'jpeg' else extension
+        if extension not in self.ALLOWED_TYPES:
+            raise serializers.ValidationError(self.INVALID_TYPE_MESSAGE)
+        return extension
+
+
+class ImageRenditionsField(serializers.Field):
+    '''Ссылки на превью картинки рецепта: все или одно по имени'''
+
+    def __init__(self, rendition=None, **kwargs):
+        self.rendition = rendition
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        urls = rendition_urls(recipe, self.context.get('request'))
+        if self.rendition is None:
+            return urls
+        return urls.get(self.rendition)
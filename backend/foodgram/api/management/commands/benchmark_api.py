@@ -0,0 +1,347 @@
+import base64
+import io
+import json
+import math
+import statistics
+import subprocess
+import time
+from itertools import count
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from recipes.models import (
+    Favorite, Ingredients, IngredientsInRecipes, Recipes, ShoppingCart, Tags
+)
+from users.models import Follow, Users
+
+# Почта и восстановление пароля меняют учётную запись и здесь не замеряются.
+SKIPPED = (
+    'users/activation/', 'users/resend_activation/', 'users/set_password/',
+    'users/reset_password/', 'users/reset_password_confirm/',
+    'users/set_email/', 'users/reset_email/', 'users/reset_email_confirm/',
+    'auth/token/logout/',
+)
+
+
+def percentile(timings, share):
+    return timings[max(math.ceil(len(timings) * share) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет p50/p95 и число SQL-запросов для эндпоинтов API '
+        'и сохраняет результаты в JSON для сравнения между коммитами'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--output', default='benchmark.json')
+        parser.add_argument(
+            '--compare', help='Прошлый JSON, с которым сравнить результаты',
+        )
+        parser.add_argument(
+            '--user', help='Почта пользователя, от имени которого замерять',
+        )
+        parser.add_argument(
+            '--staff',
+            help='Почта сотрудника для эндпоинтов только для админов',
+        )
+        parser.add_argument(
+            '--only', nargs='+', help='Замерять только эти эндпоинты',
+        )
+
+    def get_user(self, email):
+        if email:
+            return Users.objects.get(email=email)
+        # Самый нагруженный пользователь: подписки и корзина не пустые.
+        user = Users.objects.annotate(
+            follows=Count('follower', distinct=True),
+            cart=Count('shopping_cart', distinct=True),
+        ).filter(follows__gt=0, cart__gt=0).order_by(
+            '-follows', '-cart', 'pk'
+        ).first()
+        if user is None:
+            raise CommandError(
+                'Нет пользователя с подписками и корзиной, '
+                'запустите generate_synthetic_data'
+            )
+        return user
+
+    def get_staff(self, email):
+        staff = Users.objects.filter(is_staff=True, is_active=True)
+        if email:
+            return staff.get(email=email)
+        return staff.order_by('pk').first()
+
+    def client(self, user):
+        token, _ = Token.objects.get_or_create(user=user)
+        return Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def image(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 64), (73, 182, 78)).save(buffer, 'PNG')
+        return (
+            'data:image/png;base64,'
+            + base64.b64encode(buffer.getvalue()).decode()
+        )
+
+    def endpoints(self, user):
+        '''(имя, метод, путь, тело, подготовка) для каждого замера'''
+        recipe = Recipes.objects.order_by('-favorites_count', 'pk').first()
+        author = Users.objects.order_by('-recipes_count', 'pk').first()
+        free = Recipes.objects.exclude(
+            favorites__user=user
+        ).exclude(shopping_cart__user=user).order_by('pk').first()
+        stranger = Users.objects.exclude(pk=user.pk).exclude(
+            author__user=user
+        ).order_by('pk').first()
+        ingredient = Ingredients.objects.order_by('pk').first()
+        tag = Tags.objects.order_by('pk').first()
+        pantry = list(IngredientsInRecipes.objects.filter(
+            recipe__shopping_cart__user=user
+        ).values_list('ingredient_id', flat=True).distinct()[:10])
+        names = count()
+        recipe_body = {
+            'text': 'Замер',
+            'cooking_time': 10,
+            'image': self.image(),
+            'tags': [tag.pk],
+            'ingredients': [{'id': ingredient.pk, 'amount': 10}],
+        }
+        created = {}
+
+        def create_body():
+            return {**recipe_body, 'name': f'benchmark-{next(names)}'}
+
+        def created_path():
+            return f'/api/recipes/{created.get("id", recipe.pk)}/'
+
+        def remember(response):
+            created['id'] = response.json()['id']
+
+        return [
+            ('users.list', 'get', '/api/users/', None),
+            ('users.me', 'get', '/api/users/me/', None),
+            ('users.detail', 'get', f'/api/users/{author.pk}/', None),
+            ('users.subscriptions', 'get', '/api/users/subscriptions/', None),
+            ('users.subscribe', 'post',
+             f'/api/users/{stranger.pk}/subscribe/', None),
+            ('users.unsubscribe', 'delete',
+             f'/api/users/{stranger.pk}/subscribe/', None),
+            ('tags.list', 'get', '/api/tags/', None),
+            ('tags.detail', 'get', f'/api/tags/{tag.pk}/', None),
+            ('ingredients.list', 'get', '/api/ingredients/', None),
+            ('ingredients.search', 'get',
+             f'/api/ingredients/?name={ingredient.name[:2]}', None),
+            ('ingredients.detail', 'get',
+             f'/api/ingredients/{ingredient.pk}/', None),
+            ('recipes.list', 'get', '/api/recipes/', None),
+            ('recipes.list.tags', 'get',
+             f'/api/recipes/?tags={tag.slug}', None),
+            ('recipes.list.author', 'get',
+             f'/api/recipes/?author={author.pk}', None),
+            ('recipes.list.favorited', 'get',
+             '/api/recipes/?is_favorited=1', None),
+            ('recipes.list.in_cart', 'get',
+             '/api/recipes/?is_in_shopping_cart=1', None),
+            ('recipes.list.search', 'get',
+             f'/api/recipes/?search={recipe.name.split()[0]}', None),
+            ('recipes.list.popular', 'get',
+             '/api/recipes/?ordering=popular', None),
+            ('recipes.list.trending', 'get',
+             '/api/recipes/?ordering=trending', None),
+            ('recipes.list.have', 'get',
+             '/api/recipes/?have='
+             + ','.join(map(str, pantry)), None),
+            ('recipes.detail', 'get', f'/api/recipes/{recipe.pk}/', None),
+            ('recipes.similar', 'get',
+             f'/api/recipes/{recipe.pk}/similar/', None),
+            ('recipes.feed', 'get', '/api/recipes/feed/', None),
+            ('recipes.favorite', 'post',
+             f'/api/recipes/{free.pk}/favorite/', None),
+            ('recipes.unfavorite', 'delete',
+             f'/api/recipes/{free.pk}/favorite/', None),
+            ('recipes.shopping_cart', 'post',
+             f'/api/recipes/{free.pk}/shopping_cart/', None),
+            ('recipes.shopping_cart.remove', 'delete',
+             f'/api/recipes/{free.pk}/shopping_cart/', None),
+            ('recipes.bulk_favorite', 'post',
+             '/api/recipes/favorite/', {'recipes': [free.pk]}),
+            ('recipes.bulk_unfavorite', 'delete',
+             '/api/recipes/favorite/', {'recipes': [free.pk]}),
+            ('recipes.bulk_shopping_cart', 'post',
+             '/api/recipes/shopping_cart/', {'recipes': [free.pk]}),
+            ('recipes.bulk_shopping_cart.remove', 'delete',
+             '/api/recipes/shopping_cart/', {'recipes': [free.pk]}),
+            ('recipes.download_shopping_cart', 'get',
+             '/api/recipes/download_shopping_cart/', None),
+            ('recipes.download_shopping_cart.csv', 'get',
+             '/api/recipes/download_shopping_cart/?format=csv', None),
+            ('recipes.create', 'post', '/api/recipes/', create_body,
+             remember),
+            ('recipes.update', 'patch', created_path,
+             {'cooking_time': 20}),
+            ('recipes.delete', 'delete', created_path, None),
+            ('auth.token.login', 'post', '/api/auth/token/login/', {
+                'email': user.email,
+                'password': settings.SYNTHETIC_PASSWORD,
+            }),
+        ]
+
+    def staff_endpoints(self):
+        '''Эндпоинты для админов: замеряются от имени сотрудника'''
+        return [('metrics', 'get', '/api/metrics/', None)]
+
+    def request(self, client, method, path, body):
+        if callable(path):
+            path = path()
+        if callable(body):
+            body = body()
+        response = getattr(client, method)(
+            path, body, content_type='application/json'
+        ) if body is not None else getattr(client, method)(path)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def measure(self, client, endpoints, options):
+        '''Эндпоинты идут по кругу: пары POST/DELETE возвращают данные.
+
+        Первый круг только считает SQL-запросы, затем идут прогревочные
+        и замеряемые круги.
+        '''
+        results = {}
+        timings = {endpoint[0]: [] for endpoint in endpoints}
+        for iteration in range(1 + options['warmup'] + options['repeat']):
+            for name, method, path, body, *after in endpoints:
+                if iteration == 0:
+                    with CaptureQueriesContext(connection) as queries:
+                        response = self.request(client, method, path, body)
+                    results[name] = {
+                        'method': method.upper(),
+                        'path': path() if callable(path) else path,
+                        'status': response.status_code,
+                        'queries': len(queries),
+                    }
+                else:
+                    started = time.perf_counter()
+                    response = self.request(client, method, path, body)
+                    elapsed = (time.perf_counter() - started) * 1000
+                    if iteration > options['warmup']:
+                        timings[name].append(elapsed)
+                for callback in after:
+                    callback(response)
+        for name, values in timings.items():
+            values.sort()
+            results[name].update(
+                p50_ms=round(statistics.median(values), 2),
+                p95_ms=round(percentile(values, 0.95), 2),
+                mean_ms=round(statistics.mean(values), 2),
+                max_ms=round(values[-1], 2),
+            )
+        return results
+
+    def commit(self):
+        try:
+            return subprocess.run(
+                ('git', 'rev-parse', 'HEAD'),
+                capture_output=True, text=True, check=True,
+                cwd=settings.BASE_DIR,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def compare(self, results, path):
+        with open(path, encoding='utf-8') as file:
+            previous = json.load(file)['results']
+        self.stdout.write(f'Сравнение с {path}:')
+        for name, result in results.items():
+            old = previous.get(name)
+            if old is None:
+                continue
+            change = (result['p50_ms'] - old['p50_ms']) / max(
+                old['p50_ms'], 0.01
+            ) * 100
+            line = (
+                f'{name:>36}: p50 {old["p50_ms"]:.1f} -> '
+                f'{result["p50_ms"]:.1f} мс ({change:+.0f}%), запросов '
+                f'{old["queries"]} -> {result["queries"]}'
+            )
+            regressed = (
+                change > settings.BENCHMARK_REGRESSION_PERCENT
+                or result['queries'] > old['queries']
+            )
+            self.stdout.write(
+                self.style.WARNING(line) if regressed else line
+            )
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat должен быть больше нуля')
+        user = self.get_user(options['user'])
+        staff = self.get_staff(options['staff'])
+        endpoints = self.endpoints(user)
+        staff_endpoints = self.staff_endpoints()
+        if options['only']:
+            endpoints = [
+                endpoint for endpoint in endpoints
+                if endpoint[0] in options['only']
+            ]
+            staff_endpoints = [
+                endpoint for endpoint in staff_endpoints
+                if endpoint[0] in options['only']
+            ]
+        results = self.measure(self.client(user), endpoints, options)
+        if staff is None:
+            # От имени обычного пользователя замерялся бы только ответ 403.
+            if staff_endpoints:
+                self.stdout.write(self.style.WARNING(
+                    'Нет сотрудника, не замеряются: ' + ', '.join(
+                        endpoint[0] for endpoint in staff_endpoints
+                    )
+                ))
+        elif staff_endpoints:
+            results.update(
+                self.measure(self.client(staff), staff_endpoints, options)
+            )
+        report = {
+            'meta': {
+                'commit': self.commit(),
+                'created': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'repeat': options['repeat'],
+                'user': user.email,
+                'staff': staff.email if staff else None,
+                'data': {
+                    'users': Users.objects.count(),
+                    'recipes': Recipes.objects.count(),
+                    'ingredients_in_recipes':
+                        IngredientsInRecipes.objects.count(),
+                    'follows': Follow.objects.count(),
+                    'favorites': Favorite.objects.count(),
+                    'shopping_carts': ShoppingCart.objects.count(),
+                },
+                'skipped': SKIPPED,
+            },
+            'results': results,
+        }
+        with open(options['output'], 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:>36}: {result["status"]} p50 {result["p50_ms"]:.1f} '
+                f'мс, p95 {result["p95_ms"]:.1f} мс, '
+                f'запросов {result["queries"]}'
+            )
+        if options['compare']:
+            self.compare(results, options['compare'])
+        self.stdout.write(f'Результаты сохранены в {options["output"]}')
@@ -0,0 +1,83 @@
+import statistics
+import time
+from itertools import count
+from urllib.parse import quote
+
+from django.core.management import BaseCommand
+from django.test import Client
+from rest_framework.renderers import JSONRenderer
+
+from api.autocomplete import ingredient_index, normalize
+from api.serializers import IngredientsSerializer
+from recipes.models import Ingredients
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает подсказки ингредиентов целиком: запрос к API через '
+        'индекс и прежний istartswith с сериализацией'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument(
+            '--prefix-length', type=int, nargs='+', default=(1, 2, 3, 5)
+        )
+
+    def measure(self, search, queries, repeat):
+        timings = []
+        rows = 0
+        for _ in range(repeat):
+            for query in queries:
+                started = time.perf_counter()
+                rows += search(query)
+                timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        return (
+            statistics.mean(timings),
+            timings[int(len(timings) * 0.95) - 1],
+            rows / len(timings),
+        )
+
+    def orm(self, query):
+        '''Прежний путь: istartswith, сериализатор и JSON'''
+        data = IngredientsSerializer(
+            Ingredients.objects.filter(name__istartswith=query), many=True
+        ).data
+        JSONRenderer().render(data)
+        return len(data)
+
+    def api(self, query):
+        # Лишний параметр делает адрес уникальным: замеряется промах
+        # кэша ответов, а не чтение из него.
+        response = self.client.get(
+            f'/api/ingredients/?name={quote(query)}&_={next(self.requests)}'
+        )
+        return len(response.json())
+
+    def handle(self, *args, **options):
+        names = list(Ingredients.objects.values_list('name', flat=True))
+        started = time.perf_counter()
+        ingredient_index.refresh()
+        self.stdout.write(
+            f'Ингредиентов: {len(names)}, сборка индекса: '
+            f'{(time.perf_counter() - started) * 1000:.1f} мс'
+        )
+        self.client = Client()
+        self.requests = count()
+        paths = {'orm istartswith': self.orm, 'api, индекс': self.api}
+        for length in options['prefix_length']:
+            queries = sorted({
+                normalize(name)[:length] for name in names
+                if len(name) >= length
+            })
+            for label, search in paths.items():
+                mean, p95, rows = self.measure(
+                    search, queries, options['repeat']
+                )
+                self.stdout.write(
+                    f'{label:>16} | префикс {length} '
+                    f'({len(queries)} запросов): '
+                    f'среднее {mean:.3f} мс, p95 {p95:.3f} мс, '
+                    f'строк {rows:.1f}'
+                )
@@ -0,0 +1,167 @@
+import math
+import random
+import statistics
+import time
+from itertools import accumulate
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.test import Client
+
+from api.matching import ingredient_matcher
+from recipes.models import Ingredients, IngredientsInRecipes, Recipes
+from users.models import Users
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает поиск рецептов по имеющимся ингредиентам через индекс '
+        'и через GROUP BY на синтетических данных'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100_000)
+        parser.add_argument('--ingredients', type=int, default=2000)
+        parser.add_argument('--per-recipe', type=int, default=8)
+        parser.add_argument(
+            '--pantry', type=int, nargs='+', default=(5, 10, 20)
+        )
+        parser.add_argument('--missing', type=int, nargs='+', default=(0, 2))
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument(
+            '--keep', action='store_true',
+            help='Не откатывать сгенерированные данные',
+        )
+
+    def timed(self, label, function, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        self.stdout.write(
+            f'{label:>40}: p50 {statistics.median(timings):.2f} мс, '
+            f'p95 {timings[math.ceil(len(timings) * 0.95) - 1]:.2f} мс'
+        )
+
+    def generate(self, options):
+        batch_size = options['batch_size']
+        prefix = f'bench{int(time.time())}'
+        author = Users.objects.create(
+            username=prefix, email=f'{prefix}@example.com', password='!'
+        )
+        Ingredients.objects.bulk_create(
+            Ingredients(name=f'{prefix}-{number}', measurement_unit='г')
+            for number in range(options['ingredients'])
+        )
+        ingredients = list(Ingredients.objects.filter(
+            name__startswith=f'{prefix}-'
+        ).values_list('pk', flat=True))
+        Recipes.objects.bulk_create(
+            (
+                Recipes(
+                    author=author,
+                    name=f'{prefix}-{number}',
+                    text='Синтетический рецепт',
+                    image='recipes/media/benchmark.png',
+                    cooking_time=1,
+                ) for number in range(options['recipes'])
+            ),
+            batch_size=batch_size,
+        )
+        # Соль и лук встречаются чаще шафрана.
+        weights = list(accumulate(
+            1 / (rank + 1) for rank in range(len(ingredients))
+        ))
+        batch = []
+        recipes = Recipes.objects.filter(
+            name__startswith=f'{prefix}-'
+        ).values_list('pk', flat=True)
+        for recipe_id in recipes.iterator():
+            chosen = set()
+            while len(chosen) < options['per_recipe']:
+                chosen.update(random.choices(
+                    ingredients, cum_weights=weights,
+                    k=options['per_recipe'] - len(chosen),
+                ))
+            batch.extend(
+                IngredientsInRecipes(
+                    recipe_id=recipe_id, ingredient_id=ingredient_id, amount=1
+                ) for ingredient_id in chosen
+            )
+            if len(batch) >= batch_size:
+                IngredientsInRecipes.objects.bulk_create(batch)
+                batch = []
+        IngredientsInRecipes.objects.bulk_create(batch)
+        return ingredients, weights
+
+    def group_by(self, pantry, missing):
+        return list(
+            IngredientsInRecipes.objects.values('recipe').annotate(
+                total=Count('id'),
+                matched=Count('id', filter=Q(ingredient__in=pantry)),
+            ).filter(
+                matched__gte=1, total__lte=F('matched') + missing
+            ).order_by('-matched', 'total').values_list(
+                'recipe', flat=True
+            )[:6]
+        )
+
+    def measure(self, ingredients, weights, options):
+        started = time.perf_counter()
+        ingredient_matcher.rebuild()
+        postings = ingredient_matcher.postings.values()
+        self.stdout.write(
+            f'Рецептов: {Recipes.objects.count()}, строк состава: '
+            f'{IngredientsInRecipes.objects.count()}, сборка индекса: '
+            f'{time.perf_counter() - started:.2f} с, списки рецептов: '
+            f'{sum(len(p) * p.itemsize for p in postings) / 2 ** 20:.1f} МБ'
+        )
+        client = Client()
+        for size in options['pantry']:
+            pantry = list(set(random.choices(
+                ingredients, cum_weights=weights, k=size
+            )))
+            for missing in options['missing']:
+                label = f'{len(pantry)} ингредиентов, missing={missing}'
+                self.timed(
+                    f'GROUP BY | {label}',
+                    lambda: self.group_by(pantry, missing),
+                    max(options['repeat'] // 5, 1),
+                )
+                self.timed(
+                    f'индекс | {label}',
+                    lambda: ingredient_matcher.match(pantry, missing, 500),
+                    options['repeat'],
+                )
+                self.timed(
+                    f'GET /api/recipes/?have | {label}',
+                    lambda: client.get('/api/recipes/', {
+                        'have': ','.join(map(str, pantry)),
+                        'missing': missing,
+                    }),
+                    options['repeat'],
+                )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            with transaction.atomic():
+                ingredients, weights = self.generate(options)
+                self.stdout.write(
+                    f'Данные сгенерированы за '
+                    f'{time.perf_counter() - started:.1f} с'
+                )
+                self.measure(ingredients, weights, options)
+                if not options['keep']:
+                    raise Rollback
+        except Rollback:
+            self.stdout.write('Сгенерированные данные откачены')
+        ingredient_matcher.bump_version()
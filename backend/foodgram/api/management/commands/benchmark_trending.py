@@ -0,0 +1,164 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+from itertools import accumulate
+
+from django.conf import settings
+from django.core.management import BaseCommand, call_command
+from django.db import transaction
+from django.db.models import Count, Q
+from django.test import Client
+from django.utils import timezone
+
+from api.filters import ORDERINGS
+from recipes.models import Favorite, Recipes, ShoppingCart
+from users.models import Users
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает сортировку по trending_score с GROUP BY по избранному '
+        'на синтетических данных; по умолчанию данные откатываются'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--favorites', type=int, default=1_000_000)
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--recipes', type=int, default=20000)
+        parser.add_argument('--days', type=int, default=60)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument(
+            '--keep', action='store_true',
+            help='Не откатывать сгенерированные данные',
+        )
+
+    def timed(self, label, function, repeat=1):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        self.stdout.write(
+            f'{label:>34}: p50 {statistics.median(timings):.1f} мс, '
+            f'p95 {timings[max(int(len(timings) * 0.95) - 1, 0)]:.1f} мс'
+        )
+
+    def generate(self, options):
+        batch_size = options['batch_size']
+        prefix = f'bench{int(time.time())}'
+        Users.objects.bulk_create(
+            Users(
+                username=f'{prefix}-{number}',
+                email=f'{prefix}-{number}@example.com',
+                password='!',
+            ) for number in range(options['users'])
+        )
+        users = list(Users.objects.filter(
+            username__startswith=f'{prefix}-'
+        ).values_list('pk', flat=True))
+        Recipes.objects.bulk_create(
+            (
+                Recipes(
+                    author_id=random.choice(users),
+                    name=f'{prefix}-{number}',
+                    text='Синтетический рецепт',
+                    image='recipes/media/benchmark.png',
+                    cooking_time=1,
+                ) for number in range(options['recipes'])
+            ),
+            batch_size=batch_size,
+        )
+        recipes = list(Recipes.objects.filter(
+            name__startswith=f'{prefix}-'
+        ).values_list('pk', flat=True))
+        now = timezone.now()
+        seconds = options['days'] * 24 * 60 * 60
+        # Популярность рецептов неравномерная, как в жизни.
+        weights = list(accumulate(
+            1 / (rank + 1) for rank in range(len(recipes))
+        ))
+        per_user = min(options['favorites'] // len(users), len(recipes))
+        for model, share in ((Favorite, 1), (ShoppingCart, 4)):
+            batch = []
+            for user in users:
+                chosen = set()
+                while len(chosen) < per_user // share:
+                    chosen.update(random.choices(
+                        recipes, cum_weights=weights,
+                        k=per_user // share - len(chosen),
+                    ))
+                batch.extend(
+                    model(
+                        user_id=user,
+                        recipes_id=recipe,
+                        created=now - timedelta(
+                            seconds=random.randrange(seconds)
+                        ),
+                    ) for recipe in chosen
+                )
+                if len(batch) >= batch_size:
+                    model.objects.bulk_create(batch)
+                    batch = []
+            model.objects.bulk_create(batch)
+
+    def measure(self, options):
+        repeat = options['repeat']
+        since = timezone.now() - timedelta(
+            seconds=settings.TRENDING_WINDOW
+        )
+        self.stdout.write(
+            f'Избранное: {Favorite.objects.count()}, '
+            f'корзины: {ShoppingCart.objects.count()}, '
+            f'рецептов: {Recipes.objects.count()}'
+        )
+        self.timed('GROUP BY по избранному', lambda: list(
+            Recipes.objects.annotate(
+                recent=Count(
+                    'favorites', filter=Q(favorites__created__gte=since)
+                )
+            ).order_by('-recent', '-pub_date', '-id').values_list(
+                'pk', flat=True
+            )[:6]
+        ), repeat)
+        self.timed(
+            'update_trending',
+            lambda: call_command('update_trending', stdout=self.stdout),
+        )
+        for ordering in ('popular', 'trending'):
+            self.timed(f'страница по {ordering}', lambda: list(
+                Recipes.objects.order_by(
+                    *ORDERINGS[ordering]
+                ).values_list('pk', flat=True)[:6]
+            ), repeat)
+        client = Client()
+        for ordering in ('new', 'popular', 'trending'):
+            self.timed(
+                f'GET /api/recipes/?ordering={ordering}',
+                lambda: client.get(
+                    '/api/recipes/', {'ordering': ordering, 'cursor': ''}
+                ),
+                repeat,
+            )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            with transaction.atomic():
+                self.generate(options)
+                call_command('reconcile_counters', stdout=self.stdout)
+                self.stdout.write(
+                    f'Данные сгенерированы за '
+                    f'{time.perf_counter() - started:.1f} с'
+                )
+                self.measure(options)
+                if not options['keep']:
+                    raise Rollback
+        except Rollback:
+            self.stdout.write('Сгенерированные данные откачены')
@@ -0,0 +1,61 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management import BaseCommand
+
+from api.images import (
+    render_renditions, rendition_job, renditions_ready, save_renditions
+)
+from recipes.models import Recipes
+
+
+class Command(BaseCommand):
+    help = 'Строит превью картинок рецептов, у которых их ещё нет'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Количество процессов для Pillow',
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Перестроить превью у всех рецептов',
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        recipes = Recipes.objects.exclude(image='').only(
+            'id', 'image', 'image_renditions'
+        )
+        # Одна картинка может принадлежать нескольким рецептам.
+        pending = {}
+        for recipe in recipes.iterator():
+            if options['force'] or not renditions_ready(recipe):
+                pending.setdefault(recipe.image.name, []).append(recipe.pk)
+        jobs = {}
+        built = failed = 0
+        with ProcessPoolExecutor(
+            max_workers=options['workers'],
+            mp_context=multiprocessing.get_context('spawn'),
+        ) as executor:
+            for name in pending:
+                renditions, arguments = rendition_job(name)
+                future = executor.submit(render_renditions, *arguments)
+                jobs[future] = (name, renditions)
+            for future in as_completed(jobs):
+                name, renditions = jobs[future]
+                try:
+                    future.result()
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f'{name}: {error}')
+                    continue
+                for recipe_id in pending[name]:
+                    save_renditions(recipe_id, name, renditions)
+                built += len(pending[name])
+        self.stdout.write(
+            f'Превью построены для {built} рецептов, ошибок: {failed}, '
+            f'за {time.perf_counter() - started:.2f} с'
+        )
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management import BaseCommand
+
+from api.similarity import recipe_similarity
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает похожие рецепты для всех рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        created = recipe_similarity.rebuild(options['batch_size'])
+        self.stdout.write(
+            f'Сохранено пар похожих рецептов: {created} '
+            f'за {time.perf_counter() - started:.2f} с'
+        )
@@ -0,0 +1,163 @@
+import random
+from collections import Counter
+
+from django.core.management import BaseCommand, CommandError
+from django.test import Client
+from rest_framework.authtoken.models import Token
+
+from api.cache import membership_cache
+from recipes.models import Favorite, Recipes, ShoppingCart, change_counter
+from users.models import Follow, Users
+
+# Модель, адрес действия и пул, из которого берётся цель.
+ACTIONS = (
+    (Favorite, '/api/recipes/{}/favorite/', 'recipes'),
+    (ShoppingCart, '/api/recipes/{}/shopping_cart/', 'recipes'),
+    (Follow, '/api/users/{}/subscribe/', 'authors'),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Меняет избранное, корзину и подписки через API вперемешку '
+        'с изменениями «другого процесса» и сверяет множества '
+        'membership_cache с базой; в конце всё возвращается как было'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--targets', type=int, default=50)
+        parser.add_argument('--operations', type=int, default=500)
+        parser.add_argument(
+            '--foreign', type=float, default=0.2,
+            help='Доля изменений избранного в обход кэша процесса',
+        )
+        parser.add_argument('--seed', type=int, default=1)
+
+    def client(self, user):
+        token, _ = Token.objects.get_or_create(user=user)
+        return Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def toggle(self, user, model, path, target):
+        field = membership_cache.fields[model]
+        present = model.objects.filter(
+            user=user, **{field: target}
+        ).exists()
+        response = getattr(
+            self.clients[user.pk], 'delete' if present else 'post'
+        )(path.format(target))
+        if response.status_code not in (201, 204):
+            raise CommandError(
+                f'{path.format(target)}: {response.status_code} '
+                f'{response.content[:200]!r}'
+            )
+
+    def toggle_foreign(self, user, target):
+        '''Изменение из другого процесса: база и версия, но не копия'''
+        deleted, _ = Favorite.objects.filter(
+            user=user, recipes_id=target
+        ).delete()
+        if not deleted:
+            Favorite.objects.create(user=user, recipes_id=target)
+        change_counter(
+            Recipes.objects.filter(pk=target), Favorite.recipe_counter,
+            -deleted or 1,
+        )
+        membership_cache.cache.incr(membership_cache.version_key(user.pk))
+
+    def compare(self, user):
+        cached = membership_cache.get(user.pk)
+        actual = membership_cache.load(user.pk)
+        mismatched = 0
+        for model, ids in actual.items():
+            if cached[model] != ids:
+                mismatched += 1
+                self.stdout.write(self.style.ERROR(
+                    f'{user.email} {model.__name__}: лишние '
+                    f'{sorted(cached[model] - ids)}, недостающие '
+                    f'{sorted(ids - cached[model])}'
+                ))
+        return mismatched
+
+    def compare_response(self, user):
+        '''Флаги в выдаче рецептов совпадают с базой'''
+        memberships = membership_cache.load(user.pk)
+        response = self.clients[user.pk].get('/api/recipes/?limit=50')
+        mismatched = 0
+        for item in response.json()['results']:
+            expected = (
+                item['id'] in memberships[Favorite],
+                item['id'] in memberships[ShoppingCart],
+                item['author']['id'] in memberships[Follow],
+            )
+            actual = (
+                item['is_favorited'],
+                item['is_in_shopping_cart'],
+                item['author']['is_subscribed'],
+            )
+            if expected != actual:
+                mismatched += 1
+                self.stdout.write(self.style.ERROR(
+                    f'{user.email} рецепт {item["id"]}: флаги {actual}, '
+                    f'в базе {expected}'
+                ))
+        return mismatched
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        user_ids = list(Users.objects.filter(
+            is_active=True
+        ).values_list('pk', flat=True))
+        users = list(Users.objects.filter(pk__in=rng.sample(
+            user_ids, min(options['users'], len(user_ids))
+        )))
+        recipe_ids = list(Recipes.objects.values_list('pk', flat=True))
+        author_ids = list(Users.objects.filter(
+            recipes_count__gt=0
+        ).values_list('pk', flat=True))
+        if not users or not recipe_ids or len(author_ids) < 2:
+            raise CommandError(
+                'Мало данных, запустите generate_synthetic_data'
+            )
+        pools = {
+            'recipes': rng.sample(
+                recipe_ids, min(options['targets'], len(recipe_ids))
+            ),
+            'authors': rng.sample(
+                author_ids, min(options['targets'], len(author_ids))
+            ),
+        }
+        self.clients = {user.pk: self.client(user) for user in users}
+        toggled = Counter()
+        mismatched = 0
+        for user in users:
+            membership_cache.get(user.pk)
+        try:
+            for _ in range(options['operations']):
+                user = rng.choice(users)
+                model, path, pool = rng.choice(ACTIONS)
+                target = rng.choice(pools[pool])
+                if model is Follow and target == user.pk:
+                    continue
+                toggled[user, model, path, target] += 1
+                # После чужого изменения копия не сверяется: следующее
+                # изменение через API должно заметить пропуск версии.
+                if model is Favorite and rng.random() < options['foreign']:
+                    self.toggle_foreign(user, target)
+                    continue
+                self.toggle(user, model, path, target)
+                mismatched += self.compare(user)
+            for user in users:
+                mismatched += self.compare_response(user)
+        finally:
+            for (user, model, path, target), count in toggled.items():
+                if count % 2:
+                    self.toggle(user, model, path, target)
+        for user in users:
+            mismatched += self.compare(user)
+        if mismatched:
+            raise CommandError(f'Расхождений с базой: {mismatched}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Пользователей: {len(users)}, изменений: '
+            f'{sum(toggled.values())}, расхождений нет'
+        ))
@@ -0,0 +1,82 @@
+import os
+import re
+import time
+
+from django.core.management import BaseCommand, call_command
+
+from api.cache import recipe_cache
+from api.images import rendition_names
+from recipes.models import Recipes
+
+HASHED_NAME = re.compile(r'(^|/)[0-9a-f]{64}\.\w+$')
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет картинки рецептов, на которые не ссылается ни один рецепт'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что будет удалено',
+        )
+        parser.add_argument(
+            '--rehash', action='store_true',
+            help='Перенести старые файлы под имена из хэша содержимого',
+        )
+
+    def rehash(self, storage, dry_run):
+        '''Перекладывает файлы, загруженные до хранилища по хэшу'''
+        moved = 0
+        recipes = Recipes.objects.exclude(image='').only('id', 'image')
+        for recipe in recipes.iterator():
+            name = recipe.image.name
+            if HASHED_NAME.search(name) or not storage.exists(name):
+                continue
+            moved += 1
+            if dry_run:
+                continue
+            with storage.open(name) as content:
+                hashed = storage.save(name, content)
+            Recipes.objects.filter(pk=recipe.pk, image=name).update(
+                image=hashed, image_renditions={}
+            )
+            recipe_cache.invalidate(f'recipe:{recipe.pk}')
+        return moved
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        field = Recipes._meta.get_field('image')
+        storage = field.storage
+        if options['rehash']:
+            moved = self.rehash(storage, options['dry_run'])
+            self.stdout.write(f'Перенесено файлов: {moved}')
+            if moved and not options['dry_run']:
+                call_command('build_image_renditions', stdout=self.stdout)
+        keep = set()
+        for name in Recipes.objects.exclude(image='').values_list(
+            'image', flat=True
+        ).iterator():
+            keep.add(name)
+            keep.update(rendition_names(name))
+        removed = freed = 0
+        root = storage.path('')
+        for directory, _, files in os.walk(storage.path(field.upload_to)):
+            for filename in files:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, root).replace(os.sep, '/')
+                if name in keep or storage.is_fresh(name):
+                    continue
+                size = os.path.getsize(path)
+                if options['dry_run']:
+                    self.stdout.write(name)
+                else:
+                    storage.delete(name)
+                removed += 1
+                freed += size
+        self.stdout.write(
+            f'{"Можно удалить" if options["dry_run"] else "Удалено"} '
+            f'файлов: {removed}, {freed / 1024 / 1024:.1f} МБ, '
+            f'за {time.perf_counter() - started:.2f} с'
+        )
@@ -0,0 +1,120 @@
+import base64
+import json
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from api.utils import open_dataset
+from recipes.models import Ingredients, IngredientsInRecipes, Recipes, Tags
+from users.models import Users
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгружает рецепты с ингредиентами, тегами и авторами в JSON Lines '
+        'для import_recipes; файл .gz сжимается'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.IMPORT_BATCH_SIZE
+        )
+        parser.add_argument(
+            '--images', action='store_true',
+            help='Встроить картинки рецептов в выгрузку',
+        )
+
+    def write(self, file, record_type, **fields):
+        file.write(json.dumps(
+            {'type': record_type, **fields},
+            ensure_ascii=False,
+            separators=(',', ':'),
+        ))
+        file.write('\n')
+        self.written += 1
+
+    def write_image(self, file, name):
+        storage = Recipes._meta.get_field('image').storage
+        if not name or name in self.images:
+            return
+        self.images.add(name)
+        if not storage.exists(name):
+            self.missing += 1
+            return
+        with storage.open(name) as content:
+            data = base64.b64encode(content.read()).decode()
+        self.write(file, 'image', name=name, data=data)
+
+    def write_recipes(self, file, batch, options):
+        ids = [recipe['id'] for recipe in batch]
+        ingredients = defaultdict(list)
+        for recipe_id, name, amount in IngredientsInRecipes.objects.filter(
+            recipe__in=ids
+        ).order_by('pk').values_list(
+            'recipe_id', 'ingredient__name', 'amount'
+        ):
+            ingredients[recipe_id].append((name, amount))
+        tags = defaultdict(list)
+        for recipe_id, slug in Recipes.tags.through.objects.filter(
+            recipes__in=ids
+        ).values_list('recipes_id', 'tags__slug'):
+            tags[recipe_id].append(slug)
+        for recipe in batch:
+            if options['images']:
+                self.write_image(file, recipe['image'])
+            self.write(
+                file, 'recipe',
+                name=recipe['name'],
+                author=recipe['author__email'],
+                text=recipe['text'],
+                cooking_time=recipe['cooking_time'],
+                pub_date=recipe['pub_date'].isoformat(),
+                image=recipe['image'],
+                tags=tags[recipe['id']],
+                ingredients=ingredients[recipe['id']],
+            )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        batch_size = options['batch_size']
+        self.written = self.missing = 0
+        self.images = set()
+        with open_dataset(options['path'], 'w') as file:
+            for tag in Tags.objects.order_by('pk').values(
+                'name', 'color', 'slug'
+            ):
+                self.write(file, 'tag', **tag)
+            ingredients = Ingredients.objects.filter(
+                recipe_ingredients__isnull=False
+            ).distinct().order_by('pk').values('name', 'measurement_unit')
+            for ingredient in ingredients.iterator(chunk_size=batch_size):
+                self.write(file, 'ingredient', **ingredient)
+            authors = Users.objects.filter(
+                recipes__isnull=False
+            ).distinct().order_by('pk').values(
+                'email', 'username', 'first_name', 'last_name'
+            )
+            for author in authors.iterator(chunk_size=batch_size):
+                self.write(file, 'user', **author)
+            batch = []
+            recipes = Recipes.objects.order_by('pk').values(
+                'id', 'name', 'author__email', 'text', 'cooking_time',
+                'pub_date', 'image',
+            )
+            for recipe in recipes.iterator(chunk_size=batch_size):
+                batch.append(recipe)
+                if len(batch) >= batch_size:
+                    self.write_recipes(file, batch, options)
+                    batch = []
+            self.write_recipes(file, batch, options)
+        if self.missing:
+            self.stdout.write(
+                self.style.WARNING(f'Нет файлов картинок: {self.missing}')
+            )
+        self.stdout.write(
+            f'Записей выгружено: {self.written} '
+            f'за {time.perf_counter() - started:.2f} с'
+        )
@@ -0,0 +1,259 @@
+import io
+import random
+import time
+from datetime import timedelta
+from itertools import accumulate
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from api.cache import ingredients_cache, recipe_cache, tags_cache
+from api.images import render_renditions, rendition_job
+from api.matching import ingredient_matcher
+from api.utils import bulk_insert
+from recipes.models import (
+    Favorite, Ingredients, IngredientsInRecipes, Recipes, ShoppingCart, Tags
+)
+from users.models import Follow, Users
+
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Создаёт пользователей, рецепты из настоящего каталога '
+        'ингредиентов, подписки, избранное и корзины для замеров'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--min-ingredients', type=int, default=5)
+        parser.add_argument('--max-ingredients', type=int, default=20)
+        parser.add_argument('--follows', type=int, default=20)
+        parser.add_argument('--favorites', type=int, default=20)
+        parser.add_argument('--cart', type=int, default=5)
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--prefix', default='synthetic')
+        parser.add_argument(
+            '--ingredients',
+            help='Каталог для import_from_json, по умолчанию его файл',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.IMPORT_BATCH_SIZE
+        )
+
+    def skewed(self, values):
+        '''Накопленные веса: первые значения популярнее последних'''
+        values = list(values)
+        self.random.shuffle(values)
+        weights = list(accumulate(
+            1 / (rank + 1) for rank in range(len(values))
+        ))
+        return values, weights
+
+    def sample(self, values, weights, size, exclude=None):
+        size = min(size, len(values) - (exclude is not None))
+        chosen = set()
+        while len(chosen) < size:
+            chosen.update(self.random.choices(
+                values, cum_weights=weights, k=size - len(chosen)
+            ))
+            chosen.discard(exclude)
+        return chosen
+
+    def create_image(self):
+        '''Одна картинка с готовыми превью на все рецепты'''
+        buffer = io.BytesIO()
+        Image.new('RGB', (1280, 960), (226, 108, 45)).save(buffer, 'JPEG')
+        field = Recipes._meta.get_field('image')
+        name = field.storage.save(
+            field.generate_filename(None, 'synthetic.jpg'),
+            ContentFile(buffer.getvalue()),
+        )
+        renditions, arguments = rendition_job(name)
+        render_renditions(*arguments)
+        return name, {'source': name, **renditions}
+
+    def create_users(self, options):
+        password = make_password(settings.SYNTHETIC_PASSWORD)
+        prefix = options['prefix']
+        Users.objects.bulk_create(
+            (
+                Users(
+                    username=f'{prefix}-{number}',
+                    email=f'{prefix}-{number}@example.com',
+                    first_name='Тестовый',
+                    last_name=f'Пользователь {number}',
+                    password=password,
+                ) for number in range(options['users'])
+            ),
+            batch_size=options['batch_size'],
+        )
+        return list(Users.objects.filter(
+            username__startswith=f'{prefix}-'
+        ).order_by('pk').values_list('pk', flat=True))
+
+    def create_recipes(self, options, users, image):
+        prefix = options['prefix']
+        authors, author_weights = self.skewed(users)
+        ingredients, ingredient_weights = self.skewed(
+            Ingredients.objects.values_list('pk', flat=True)
+        )
+        if len(ingredients) < options['max_ingredients']:
+            raise CommandError('В каталоге мало ингредиентов')
+        tags = list(Tags.objects.values_list('pk', flat=True))
+        now = timezone.now()
+        seconds = options['days'] * 24 * 60 * 60
+        recipes = []
+        for start in range(0, options['recipes'], options['batch_size']):
+            numbers = range(
+                start, min(start + options['batch_size'], options['recipes'])
+            )
+            bulk_insert(
+                Recipes,
+                (
+                    'author', 'name', 'text', 'cooking_time', 'image',
+                    'pub_date', 'image_renditions', 'favorites_count',
+                    'shopping_cart_count', 'trending_score',
+                ),
+                [
+                    (
+                        self.random.choices(
+                            authors, cum_weights=author_weights
+                        )[0],
+                        f'{prefix} рецепт {number}',
+                        'Нарезать, смешать и готовить до готовности.',
+                        self.random.randint(5, 180),
+                        image[0],
+                        now - timedelta(
+                            seconds=self.random.randrange(seconds)
+                        ),
+                        image[1], 0, 0, 0,
+                    ) for number in numbers
+                ],
+            )
+            ids = list(Recipes.objects.filter(
+                name__in=[f'{prefix} рецепт {number}' for number in numbers]
+            ).order_by('pk').values_list('pk', flat=True))
+            bulk_insert(
+                IngredientsInRecipes,
+                ('recipe', 'ingredient', 'amount'),
+                [
+                    (recipe_id, ingredient_id, self.random.randint(1, 500))
+                    for recipe_id in ids
+                    for ingredient_id in self.sample(
+                        ingredients, ingredient_weights,
+                        self.random.randint(
+                            options['min_ingredients'],
+                            options['max_ingredients'],
+                        ),
+                    )
+                ],
+            )
+            bulk_insert(
+                Recipes.tags.through,
+                ('recipes', 'tags'),
+                [
+                    (recipe_id, tag_id)
+                    for recipe_id in ids
+                    for tag_id in self.random.sample(
+                        tags, self.random.randint(1, len(tags))
+                    )
+                ],
+            )
+            recipes.extend(ids)
+        return recipes
+
+    def create_relations(self, options, users, recipes):
+        authors, author_weights = self.skewed(users)
+        recipes, recipe_weights = self.skewed(recipes)
+        now = timezone.now()
+        seconds = settings.TRENDING_WINDOW * 2
+        bulk_insert(
+            Follow,
+            ('user', 'author'),
+            [
+                (user_id, author_id)
+                for user_id in users
+                for author_id in self.sample(
+                    authors, author_weights, options['follows'],
+                    exclude=user_id,
+                )
+            ],
+        )
+        for model, option in ((Favorite, 'favorites'), (ShoppingCart, 'cart')):
+            bulk_insert(
+                model,
+                ('user', 'recipes', 'created'),
+                [
+                    (
+                        user_id,
+                        recipe_id,
+                        now - timedelta(
+                            seconds=self.random.randrange(seconds)
+                        ),
+                    )
+                    for user_id in users
+                    for recipe_id in self.sample(
+                        recipes, recipe_weights, options[option]
+                    )
+                ],
+            )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        self.random = random.Random(options['seed'])
+        if Users.objects.filter(
+            username__startswith=f'{options["prefix"]}-'
+        ).exists():
+            raise CommandError(
+                f'Данные с префиксом {options["prefix"]} уже есть, '
+                f'укажите другой --prefix'
+            )
+        call_command(
+            'import_from_json',
+            *filter(None, [options['ingredients']]),
+            stdout=self.stdout,
+        )
+        if not Tags.objects.exists():
+            Tags.objects.bulk_create(
+                Tags(name=name, color=color, slug=slug)
+                for name, color, slug in TAGS
+            )
+        image = self.create_image()
+        with transaction.atomic():
+            users = self.create_users(options)
+            recipes = self.create_recipes(options, users, image)
+            self.create_relations(options, users, recipes)
+        self.stdout.write(
+            f'Пользователей: {len(users)}, рецептов: {len(recipes)}, '
+            f'за {time.perf_counter() - started:.1f} с'
+        )
+        # Данные вставлены без сигналов: производные таблицы
+        # и индексы пересобираются целиком.
+        for command in (
+            'reconcile_counters', 'rebuild_shopping_cart', 'rebuild_feeds',
+            'update_trending', 'rebuild_search_index',
+        ):
+            call_command(command, stdout=self.stdout)
+        tags_cache.invalidate()
+        ingredients_cache.invalidate()
+        recipe_cache.invalidate_lists(
+            users, Tags.objects.values_list('slug', flat=True)
+        )
+        ingredient_matcher.bump_version()
+        call_command('build_similar_recipes', stdout=self.stdout)
+        self.stdout.write(
+            f'Готово за {time.perf_counter() - started:.1f} с'
+        )
@@ -1,28 +1,144 @@
+import csv
 import json
 import os
+import time
 
-from django.core.management import BaseCommand
+from django.core.management import BaseCommand, CommandError
 from django.conf import settings
+from django.db import transaction
 
+from api.cache import ingredients_cache
 from recipes.models import Ingredients
 
 FILE_DIR = os.path.join(settings.BASE_DIR, 'data')
 
 
+def read_json(file, chunk_size):
+    '''Объекты из JSON-массива или JSON Lines по одному, без json.load'''
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    finished = False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n[,]':
+            position += 1
+        if position == len(buffer):
+            if finished:
+                return
+            buffer = file.read(chunk_size)
+            position = 0
+            finished = not buffer
+            continue
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if finished:
+                raise
+            # Объект разрезан границей куска: дочитываем файл.
+            chunk = file.read(chunk_size)
+            finished = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield item['name'], item['measurement_unit']
+        position = end
+
+
+def read_csv(file, chunk_size):
+    for row in csv.reader(file):
+        if row:
+            yield row[0], row[1]
+
+
+READERS = {
+    'json': read_json,
+    'csv': read_csv,
+}
+
+
 class Command(BaseCommand):
-    def handle(self, *args, **options):
-        # data_path = f'{FILE_DIR}/ingredients.json'
-        with open('/app/data/ingredients.json', encoding='utf-8') as file:
-            data = json.load(file)
-        ingredients = []
-        unique_names = set()
-        for item in data:
-            name = item['name']
-            if name and name not in unique_names:
-                unique_names.add(name)
-                ingredient = Ingredients(
-                    name=item['name'],
-                    measurement_unit=item['measurement_unit'],
+    help = (
+        'Загружает ингредиенты из JSON или CSV пачками, не читая файл '
+        'целиком; уже загруженные ингредиенты пропускаются'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?',
+            default=os.path.join(FILE_DIR, 'ingredients.json'),
+        )
+        parser.add_argument('--format', choices=READERS)
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.IMPORT_BATCH_SIZE
+        )
+        parser.add_argument(
+            '--update', action='store_true',
+            help='Обновлять единицу измерения у уже загруженных',
+        )
+
+    def save(self, batch, update):
+        '''Возвращает число обновлённых ингредиентов'''
+        updated = []
+        with transaction.atomic():
+            if update:
+                for ingredient in Ingredients.objects.filter(
+                    name__in=batch
+                ).select_for_update():
+                    unit = batch[ingredient.name]
+                    if ingredient.measurement_unit != unit:
+                        ingredient.measurement_unit = unit
+                        updated.append(ingredient)
+                Ingredients.objects.bulk_update(
+                    updated, ('measurement_unit',)
                 )
-                ingredients.append(ingredient)
-        Ingredients.objects.bulk_create(ingredients)
+            Ingredients.objects.bulk_create(
+                (
+                    Ingredients(name=name, measurement_unit=unit)
+                    for name, unit in batch.items()
+                ),
+                ignore_conflicts=True,
+            )
+        return len(updated)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(
+            path
+        )[1].lstrip('.').lower()
+        if file_format not in READERS:
+            raise CommandError(
+                f'Неизвестный формат файла {path}, укажите --format'
+            )
+        started = time.perf_counter()
+        before = Ingredients.objects.count()
+        read = updated = 0
+        batch = {}
+        try:
+            with open(path, encoding='utf-8', newline='') as file:
+                for name, unit in READERS[file_format](
+                    file, settings.IMPORT_READ_CHUNK_SIZE
+                ):
+                    read += 1
+                    name, unit = name.strip(), unit.strip()
+                    if not name:
+                        continue
+                    batch[name] = unit
+                    if len(batch) >= options['batch_size']:
+                        updated += self.save(batch, options['update'])
+                        batch = {}
+                        self.stdout.write(
+                            f'Прочитано строк: {read}, '
+                            f'{time.perf_counter() - started:.1f} с'
+                        )
+            if batch:
+                updated += self.save(batch, options['update'])
+        except (OSError, ValueError, KeyError, IndexError) as error:
+            raise CommandError(f'Не удалось прочитать {path}: {error!r}')
+        finally:
+            ingredients_cache.invalidate()
+        created = Ingredients.objects.count() - before
+        self.stdout.write(
+            f'Прочитано строк: {read}, добавлено ингредиентов: {created}, '
+            f'обновлено: {updated}, пропущено: {read - created - updated}, '
+            f'за {time.perf_counter() - started:.2f} с'
+        )
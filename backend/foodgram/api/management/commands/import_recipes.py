@@ -0,0 +1,222 @@
+import base64
+import json
+import os
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from api.cache import ingredients_cache, recipe_cache, tags_cache
+from api.matching import ingredient_matcher
+from api.search import get_search_backend
+from api.utils import bulk_insert, open_dataset
+from recipes.models import Ingredients, IngredientsInRecipes, Recipes, Tags
+from users.models import Users
+
+# Порядок сохранения: рецепты ссылаются на всё остальное.
+RECORD_TYPES = ('tag', 'ingredient', 'user', 'recipe')
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает выгрузку export_recipes одной транзакцией; уже '
+        'существующие теги, ингредиенты, авторы и рецепты пропускаются'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.IMPORT_BATCH_SIZE
+        )
+        parser.add_argument(
+            '--skip-conflicts', action='store_true',
+            help=(
+                'Пропускать авторов, чей username занят пользователем с '
+                'другой почтой, вместе с их рецептами'
+            ),
+        )
+
+    def save_natural(self, model, key, records, ids, **defaults):
+        '''Создаёт недостающие записи, запоминает id по естественному ключу'''
+        model.objects.bulk_create(
+            (model(**defaults, **record) for record in records),
+            ignore_conflicts=True,
+        )
+        ids.update(model.objects.filter(**{
+            f'{key}__in': [record[key] for record in records]
+        }).values_list(key, 'id'))
+
+    def save_tags(self, records):
+        self.save_natural(Tags, 'slug', records, self.tags)
+
+    def save_ingredients(self, records):
+        self.save_natural(Ingredients, 'name', records, self.ingredients)
+
+    def save_users(self, records):
+        self.save_natural(
+            Users, 'email', records, self.users,
+            password=make_password(None),
+        )
+        # Почты нет, значит строку отбросил конфликт по username.
+        conflicts = [
+            record for record in records if record['email'] not in self.users
+        ]
+        if conflicts and not self.skip_conflicts:
+            raise CommandError(
+                f'Авторов с занятым username: {len(conflicts)}, например '
+                f'{conflicts[0]["username"]} ({conflicts[0]["email"]}); '
+                f'--skip-conflicts пропустит их вместе с рецептами'
+            )
+        self.conflicts.update(record['email'] for record in conflicts)
+
+    def save_image(self, record):
+        field = Recipes._meta.get_field('image')
+        self.images[record['name']] = field.storage.save(
+            field.generate_filename(None, os.path.basename(record['name'])),
+            ContentFile(base64.b64decode(record['data'])),
+        )
+
+    def save_recipes(self, records):
+        records = {record['name']: record for record in records}
+        existing = set(Recipes.objects.filter(
+            name__in=records
+        ).values_list('name', flat=True))
+        records = [
+            record for name, record in records.items()
+            if name not in existing
+        ]
+        self.skipped += sum(
+            record['author'] in self.conflicts for record in records
+        )
+        records = [
+            record for record in records if record['author'] in self.users
+        ]
+        bulk_insert(
+            Recipes,
+            (
+                'author', 'name', 'text', 'cooking_time', 'image',
+                'pub_date', 'image_renditions', 'favorites_count',
+                'shopping_cart_count', 'trending_score',
+            ),
+            [
+                (
+                    self.users[record['author']],
+                    record['name'],
+                    record['text'],
+                    record['cooking_time'],
+                    self.images.get(record['image'], record['image']),
+                    parse_datetime(record['pub_date']),
+                    {}, 0, 0, 0,
+                ) for record in records
+            ],
+        )
+        ids = dict(Recipes.objects.filter(
+            name__in=[record['name'] for record in records]
+        ).values_list('name', 'id'))
+        bulk_insert(
+            IngredientsInRecipes,
+            ('recipe', 'ingredient', 'amount'),
+            [
+                (ids[record['name']], self.ingredients[name], amount)
+                for record in records
+                for name, amount in record['ingredients']
+                if name in self.ingredients
+            ],
+        )
+        bulk_insert(
+            Recipes.tags.through,
+            ('recipes', 'tags'),
+            [
+                (ids[record['name']], self.tags[slug])
+                for record in records
+                for slug in record['tags'] if slug in self.tags
+            ],
+        )
+        authors = {self.users[record['author']] for record in records}
+        self.authors |= authors
+        self.recipe_tags.update(
+            slug for record in records for slug in record['tags']
+            if slug in self.tags
+        )
+        self.followed = self.followed or Users.objects.filter(
+            pk__in=authors, followers_count__gt=0,
+        ).exists()
+        self.created += len(records)
+
+    def flush(self, pending, until):
+        for record_type in RECORD_TYPES[:RECORD_TYPES.index(until) + 1]:
+            if pending[record_type]:
+                getattr(self, f'save_{record_type}s')(pending[record_type])
+                pending[record_type] = []
+
+    def load(self, path, batch_size):
+        pending = {record_type: [] for record_type in RECORD_TYPES}
+        read = 0
+        with open_dataset(path, 'r') as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                record_type = record.pop('type')
+                read += 1
+                # Картинки тяжёлые, их не копим.
+                if record_type == 'image':
+                    self.save_image(record)
+                    continue
+                if record_type not in pending:
+                    raise CommandError(f'Неизвестная запись: {record_type}')
+                pending[record_type].append(record)
+                if len(pending[record_type]) >= batch_size:
+                    self.flush(pending, record_type)
+                    self.stdout.write(
+                        f'Прочитано записей: {read}, рецептов добавлено: '
+                        f'{self.created}'
+                    )
+        self.flush(pending, RECORD_TYPES[-1])
+        return read
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        self.tags, self.ingredients, self.users, self.images = {}, {}, {}, {}
+        self.authors, self.recipe_tags = set(), set()
+        self.followed = False
+        self.created = 0
+        self.skip_conflicts = options['skip_conflicts']
+        self.conflicts = set()
+        self.skipped = 0
+        try:
+            with transaction.atomic():
+                read = self.load(options['path'], options['batch_size'])
+                call_command('reconcile_counters', stdout=self.stdout)
+        except (OSError, ValueError, KeyError) as error:
+            raise CommandError(
+                f'Не удалось загрузить {options["path"]}: {error!r}'
+            )
+        self.stdout.write(
+            f'Прочитано записей: {read}, рецептов добавлено: '
+            f'{self.created}, за {time.perf_counter() - started:.2f} с'
+        )
+        if self.conflicts:
+            self.stderr.write(
+                f'Пропущено авторов с занятым username: '
+                f'{len(self.conflicts)}, их рецептов: {self.skipped}'
+            )
+        # bulk_create не отправляет сигналы: индексы и ленты
+        # обновляются здесь целиком.
+        tags_cache.invalidate()
+        ingredients_cache.invalidate()
+        recipe_cache.invalidate_lists(self.authors, self.recipe_tags)
+        ingredient_matcher.bump_version()
+        get_search_backend().rebuild()
+        if self.followed:
+            call_command('rebuild_feeds', stdout=self.stdout)
+        if self.images:
+            call_command('build_image_renditions', stdout=self.stdout)
+        self.stdout.write(
+            f'Индексы обновлены, всего '
+            f'{time.perf_counter() - started:.2f} с'
+        )
@@ -0,0 +1,47 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from recipes.models import FeedEntry, Recipes
+from users.models import Follow
+
+
+class Command(BaseCommand):
+    help = 'Заново раскладывает рецепты по лентам подписчиков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        FeedEntry.objects.all().delete()
+        batch = []
+        created = popular = 0
+        authors = Follow.objects.order_by().values_list(
+            'author_id', flat=True
+        ).distinct()
+        for author_id in authors.iterator():
+            followers = FeedEntry.objects.followers(author_id)
+            if followers is None:
+                popular += 1
+                continue
+            recipes = Recipes.objects.filter(
+                author_id=author_id
+            ).values_list('id', 'pub_date')
+            for recipe_id, pub_date in recipes.iterator():
+                for user_id in followers:
+                    batch.append(FeedEntry(
+                        user_id=user_id,
+                        author_id=author_id,
+                        recipe_id=recipe_id,
+                        pub_date=pub_date,
+                    ))
+                if len(batch) >= batch_size:
+                    FeedEntry.objects.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+        FeedEntry.objects.bulk_create(batch)
+        self.stdout.write(
+            f'Записей в лентах: {created + len(batch)}, '
+            f'популярных авторов без раскладки: {popular}'
+        )
@@ -0,0 +1,16 @@
+import time
+
+from django.core.management import BaseCommand
+
+from api.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает поисковый индекс рецептов'
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        get_search_backend().rebuild()
+        self.stdout.write(
+            f'Индекс пересобран за {time.perf_counter() - started:.2f} с'
+        )
@@ -0,0 +1,71 @@
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import ShoppingCartIngredient
+
+TOLERANCE = 1e-6
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает суммы ингредиентов в корзинах пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только сверить суммы с корзинами, ничего не меняя',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def check(self):
+        stored = {
+            (user, ingredient): (amount, count)
+            for user, ingredient, amount, count
+            in ShoppingCartIngredient.objects.values_list(
+                'user', 'ingredient', 'amount', 'recipes_count'
+            ).iterator()
+        }
+        mismatched = 0
+        live_totals = ShoppingCartIngredient.objects.live_totals()
+        for user, ingredient, amount, count in live_totals.iterator():
+            stored_amount, stored_count = stored.pop(
+                (user, ingredient), (0, 0)
+            )
+            if (
+                abs(stored_amount - amount) > TOLERANCE
+                or stored_count != count
+            ):
+                mismatched += 1
+        return mismatched, len(stored)
+
+    @transaction.atomic
+    def rebuild(self, batch_size):
+        ShoppingCartIngredient.objects.all().delete()
+        batch = []
+        created = 0
+        live_totals = ShoppingCartIngredient.objects.live_totals()
+        for user, ingredient, amount, count in live_totals.iterator():
+            batch.append(ShoppingCartIngredient(
+                user_id=user,
+                ingredient_id=ingredient,
+                amount=amount,
+                recipes_count=count,
+            ))
+            if len(batch) >= batch_size:
+                ShoppingCartIngredient.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        ShoppingCartIngredient.objects.bulk_create(batch)
+        return created + len(batch)
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            created = self.rebuild(options['batch_size'])
+            self.stdout.write(f'Пересчитано строк: {created}')
+        mismatched, extra = self.check()
+        if mismatched or extra:
+            raise CommandError(
+                f'Расхождений с корзинами: {mismatched}, '
+                f'лишних строк: {extra}'
+            )
+        self.stdout.write(self.style.SUCCESS('Суммы совпадают с корзинами'))
@@ -0,0 +1,59 @@
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from api.cache import recipe_cache
+from recipes.models import Favorite, Recipes, ShoppingCart
+from users.models import Follow, Users
+
+# (модель со счётчиком, поле счётчика, считаемая модель, её внешний ключ)
+COUNTERS = (
+    (Recipes, 'favorites_count', Favorite, 'recipes'),
+    (Recipes, 'shopping_cart_count', ShoppingCart, 'recipes'),
+    (Users, 'followers_count', Follow, 'author'),
+    (Users, 'recipes_count', Recipes, 'author'),
+)
+
+
+class Command(BaseCommand):
+    help = 'Сверяет счётчики избранного, корзин, подписчиков и рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только сверить счётчики, ничего не меняя',
+        )
+
+    def actual(self, counted, key):
+        return Coalesce(Subquery(
+            counted.objects.filter(
+                **{key: OuterRef('pk')}
+            ).order_by().values(key).annotate(
+                count=Count('pk')
+            ).values('count')
+        ), 0)
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        mismatched_total = 0
+        for model, field, counted, key in COUNTERS:
+            actual = self.actual(counted, key)
+            mismatched = model.objects.annotate(actual=actual).exclude(
+                **{field: F('actual')}
+            )
+            count = mismatched.count()
+            mismatched_total += count
+            if count and not options['check']:
+                model.objects.filter(
+                    pk__in=mismatched.values('pk')
+                ).update(**{field: actual})
+                recipe_cache.invalidate(f'field:{field}')
+            self.stdout.write(
+                f'{model._meta.verbose_name_plural}.{field}: '
+                f'расхождений {count}'
+            )
+        if options['check'] and mismatched_total:
+            raise CommandError(f'Расхождений: {mismatched_total}')
+        self.stdout.write(self.style.SUCCESS('Счётчики сверены'))
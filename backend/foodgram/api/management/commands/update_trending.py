@@ -0,0 +1,93 @@
+import math
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from api.cache import recipe_cache
+from recipes.models import Favorite, Recipes, ShoppingCart
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает trending_score рецептов по недавним добавлениям '
+        'в избранное и в корзину'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help='Повторять пересчёт каждые N секунд',
+        )
+
+    def scores(self, now):
+        '''Добавления группируются по часам, затухание считается по часу'''
+        since = now - timedelta(seconds=settings.TRENDING_WINDOW)
+        decay = math.log(2) / settings.TRENDING_HALF_LIFE
+        scores = defaultdict(float)
+        sources = (
+            (Favorite, settings.TRENDING_FAVORITE_WEIGHT),
+            (ShoppingCart, settings.TRENDING_SHOPPING_CART_WEIGHT),
+        )
+        for model, weight in sources:
+            rows = model.objects.filter(created__gte=since).annotate(
+                hour=TruncHour('created')
+            ).values_list('recipes_id', 'hour').annotate(
+                count=Count('id')
+            ).order_by()
+            for recipe_id, hour, count in rows.iterator():
+                age = max((now - hour).total_seconds() - 30 * 60, 0)
+                scores[recipe_id] += weight * count * math.exp(-decay * age)
+        return scores
+
+    @transaction.atomic
+    def store(self, scores, batch_size):
+        '''Пишет только оценки, изменившиеся больше чем на
+        TRENDING_MIN_CHANGE, возвращает (записано, обнулено)'''
+        stored = dict(Recipes.objects.filter(
+            trending_score__gt=0
+        ).values_list('pk', 'trending_score').iterator())
+        stale = [pk for pk in stored if pk not in scores]
+        changed = [
+            Recipes(pk=pk, trending_score=score)
+            for pk, score in scores.items()
+            if not math.isclose(
+                score, stored.get(pk, 0),
+                rel_tol=settings.TRENDING_MIN_CHANGE,
+            )
+        ]
+        for start in range(0, len(stale), batch_size):
+            Recipes.objects.filter(
+                pk__in=stale[start:start + batch_size]
+            ).update(trending_score=0)
+        Recipes.objects.bulk_update(
+            changed, ('trending_score',), batch_size=batch_size
+        )
+        if stale or changed:
+            recipe_cache.invalidate('field:trending_score')
+        return len(changed), len(stale)
+
+    def update(self, batch_size):
+        started = time.perf_counter()
+        scores = self.scores(timezone.now())
+        counted = time.perf_counter()
+        written, reset = self.store(scores, batch_size)
+        self.stdout.write(
+            f'Рецептов с оценкой: {len(scores)}, записано: {written}, '
+            f'обнулено: {reset}, подсчёт {counted - started:.2f} с, '
+            f'запись {time.perf_counter() - counted:.2f} с'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            self.update(options['batch_size'])
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,169 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter
+from itertools import chain
+
+from django.conf import settings
+from django.core.cache import caches
+
+from recipes.models import IngredientsInRecipes
+
+
+class IngredientMatcher:
+    '''Обратный индекс «ингредиент -> рецепты» для поиска по продуктам.
+
+    Списки рецептов хранятся отсортированными массивами array('I'),
+    покрытие считается подсчётом вхождений по спискам нужных
+    ингредиентов, без GROUP BY по IngredientsInRecipes. Версия индекса
+    лежит в общем кэше; рядом с каждой версией хранится список
+    изменённых рецептов, и отставший процесс перечитывает только их.
+    Полная пересборка - если журнала не хватает (после массовой
+    загрузки или истечения записей).
+    '''
+    version_key = 'matching:ingredient-index:version'
+    changes_key = 'matching:ingredient-index:changes:{}'
+
+    def __init__(self):
+        self.built = False
+        self.version = None
+        self.postings = {}
+        self.sizes = {}
+        self.lock = threading.RLock()
+
+    @property
+    def cache(self):
+        return caches[settings.DICTIONARY_CACHE]
+
+    def rebuild(self):
+        postings = {}
+        sizes = Counter()
+        rows = IngredientsInRecipes.objects.order_by(
+            'ingredient_id', 'recipe_id'
+        ).values_list('ingredient_id', 'recipe_id')
+        for ingredient_id, recipe_id in rows.iterator(chunk_size=10000):
+            posting = postings.get(ingredient_id)
+            if posting is None:
+                posting = postings[ingredient_id] = array('I')
+            posting.append(recipe_id)
+            sizes[recipe_id] += 1
+        with self.lock:
+            self.postings = postings
+            self.sizes = dict(sizes)
+
+    def get_version(self):
+        version = self.cache.get(self.version_key)
+        if version is None:
+            # Начальное значение - время, чтобы после вытеснения ключа
+            # версии не повторились.
+            self.cache.add(self.version_key, time.time_ns(), None)
+            version = self.cache.get(self.version_key)
+        return version
+
+    def refresh(self):
+        version = self.get_version()
+        if self.built and version == self.version:
+            return
+        with self.lock:
+            if self.built and version == self.version:
+                return
+            if not self.catch_up(version):
+                self.rebuild()
+                self.built = True
+                self.version = version
+
+    def catch_up(self, version):
+        '''Применяет чужие изменения по журналу, False - если его мало'''
+        if not self.built or self.version is None or version is None:
+            return False
+        if not 0 < version - self.version <= settings.MATCHING_MAX_CHANGES:
+            return False
+        keys = [
+            self.changes_key.format(number)
+            for number in range(self.version + 1, version + 1)
+        ]
+        changes = self.cache.get_many(keys)
+        if len(changes) != len(keys):
+            return False
+        self.apply(set(chain.from_iterable(changes.values())))
+        self.version = version
+        return True
+
+    def bump_version(self, recipes=None):
+        '''Атомарно увеличивает версию и записывает изменённые рецепты.
+
+        Без recipes (массовые изменения) другие процессы пересоберут
+        индекс целиком.
+        '''
+        self.get_version()
+        version = self.cache.incr(self.version_key)
+        if recipes is not None:
+            self.cache.set(
+                self.changes_key.format(version), list(recipes),
+                settings.MATCHING_CHANGES_TIMEOUT,
+            )
+        if self.version == version - 1:
+            self.version = version
+
+    def remove_recipe(self, recipe_id):
+        if self.sizes.pop(recipe_id, None) is None:
+            return
+        for ingredient_id, posting in list(self.postings.items()):
+            position = bisect_left(posting, recipe_id)
+            if position < len(posting) and posting[position] == recipe_id:
+                del posting[position]
+                if not posting:
+                    del self.postings[ingredient_id]
+
+    def apply(self, recipes):
+        '''Перечитывает из базы ингредиенты рецептов'''
+        for recipe_id in recipes:
+            self.remove_recipe(recipe_id)
+        for ingredient_id, recipe_id in (
+            IngredientsInRecipes.objects.filter(
+                recipe__in=recipes
+            ).values_list('ingredient_id', 'recipe_id')
+        ):
+            posting = self.postings.setdefault(ingredient_id, array('I'))
+            insort(posting, recipe_id)
+            self.sizes[recipe_id] = self.sizes.get(recipe_id, 0) + 1
+
+    def update(self, recipes):
+        with self.lock:
+            if self.built:
+                self.apply(recipes)
+            self.bump_version(recipes)
+
+    def remove(self, recipe_id):
+        with self.lock:
+            self.remove_recipe(recipe_id)
+            self.bump_version([recipe_id])
+
+    def match(self, ingredients, missing=0, limit=None):
+        '''[(recipe_id, доля покрытых ингредиентов)] по убыванию доли.
+
+        В рецепте может не хватать не больше missing ингредиентов.
+        '''
+        self.refresh()
+        with self.lock:
+            postings = [
+                self.postings[ingredient_id]
+                for ingredient_id in set(ingredients)
+                if ingredient_id in self.postings
+            ]
+            matched = Counter(chain.from_iterable(postings))
+            sizes = self.sizes
+            scores = [
+                (count / sizes[recipe_id], count, recipe_id)
+                for recipe_id, count in matched.items()
+                if sizes[recipe_id] - count <= missing
+            ]
+        scores.sort(reverse=True)
+        return [
+            (recipe_id, coverage)
+            for coverage, _, recipe_id in scores[:limit]
+        ]
+
+
+ingredient_matcher = IngredientMatcher()
@@ -0,0 +1,260 @@
+import bisect
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.serializers import BaseSerializer
+
+logger = logging.getLogger(__name__)
+
+current_stats = ContextVar('current_stats', default=None)
+
+
+class RequestStats:
+    '''Запросы к базе и время одного HTTP-запроса.
+
+    Объект сам служит execute_wrapper для всех соединений.
+    '''
+
+    def __init__(self):
+        self.action = None
+        self.queries = 0
+        self.db_time = 0
+        self.serializer_time = 0
+        self.serializing = 0
+        self.patterns = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            # Параметры не учитываются: одинаковый шаблон с разными
+            # параметрами и есть N+1.
+            self.patterns[sql] += 1
+
+    def duplicates(self):
+        return {
+            sql: count for sql, count in self.patterns.most_common()
+            if count >= settings.METRICS_DUPLICATE_THRESHOLD
+        }
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n'
+    )
+
+
+class Aggregate:
+    '''Накопленные показатели одного действия для /api/metrics/'''
+
+    def __init__(self):
+        self.requests = 0
+        self.buckets = [0] * len(settings.METRICS_BUCKETS)
+        self.duration = 0
+        self.queries = 0
+        self.db_time = 0
+        self.serializer_time = 0
+        self.response_bytes = 0
+        self.duplicates = 0
+
+    def add(self, stats, duration, size):
+        self.requests += 1
+        position = bisect.bisect_left(settings.METRICS_BUCKETS, duration)
+        if position < len(self.buckets):
+            self.buckets[position] += 1
+        self.duration += duration
+        self.queries += stats.queries
+        self.db_time += stats.db_time
+        self.serializer_time += stats.serializer_time
+        self.response_bytes += size
+        self.duplicates += bool(stats.duplicates())
+
+
+class Registry:
+    '''Показатели процесса в текстовом формате Prometheus'''
+    counters = (
+        ('queries', 'foodgram_db_queries_total',
+         'Запросы к базе'),
+        ('db_time', 'foodgram_db_duration_seconds_total',
+         'Время запросов к базе'),
+        ('serializer_time', 'foodgram_serializer_duration_seconds_total',
+         'Время сериализации'),
+        ('response_bytes', 'foodgram_response_bytes_total',
+         'Размер ответов'),
+        ('duplicates', 'foodgram_duplicate_queries_requests_total',
+         'Запросы с повторяющимися SQL'),
+    )
+
+    def __init__(self):
+        self.aggregates = {}
+        self.lock = threading.Lock()
+
+    def add(self, labels, stats, duration, size):
+        with self.lock:
+            aggregate = self.aggregates.get(labels)
+            if aggregate is None:
+                aggregate = self.aggregates[labels] = Aggregate()
+            aggregate.add(stats, duration, size)
+
+    def format_labels(self, labels, **extra):
+        pairs = dict(zip(('action', 'method', 'status'), labels), **extra)
+        return ','.join(
+            f'{key}="{escape_label(value)}"' for key, value in pairs.items()
+        )
+
+    def render(self):
+        with self.lock:
+            aggregates = [
+                (labels, vars(aggregate).copy())
+                for labels, aggregate in sorted(self.aggregates.items())
+            ]
+        name = 'foodgram_request_duration_seconds'
+        lines = [
+            f'# HELP {name} Время ответа',
+            f'# TYPE {name} histogram',
+        ]
+        for labels, values in aggregates:
+            total = 0
+            for bound, count in zip(
+                settings.METRICS_BUCKETS, values['buckets']
+            ):
+                total += count
+                lines.append(
+                    f'{name}_bucket'
+                    f'{{{self.format_labels(labels, le=bound)}}} {total}'
+                )
+            lines.append(
+                f'{name}_bucket{{{self.format_labels(labels, le="+Inf")}}} '
+                f'{values["requests"]}'
+            )
+            lines.append(
+                f'{name}_sum{{{self.format_labels(labels)}}} '
+                f'{values["duration"]}'
+            )
+            lines.append(
+                f'{name}_count{{{self.format_labels(labels)}}} '
+                f'{values["requests"]}'
+            )
+        for field, name, description in self.counters:
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} counter')
+            lines.extend(
+                f'{name}{{{self.format_labels(labels)}}} {values[field]}'
+                for labels, values in aggregates
+            )
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def timed_data(data):
+    '''Считает время BaseSerializer.data, вложенные вызовы не удваиваются'''
+
+    def wrapper(self):
+        stats = current_stats.get()
+        if stats is None:
+            return data.fget(self)
+        stats.serializing += 1
+        started = time.perf_counter()
+        try:
+            return data.fget(self)
+        finally:
+            stats.serializing -= 1
+            if not stats.serializing:
+                stats.serializer_time += time.perf_counter() - started
+
+    wrapper.instrumented = True
+    return property(wrapper)
+
+
+def instrument_serializers():
+    if not getattr(BaseSerializer.data.fget, 'instrumented', False):
+        BaseSerializer.data = timed_data(BaseSerializer.data)
+
+
+class InstrumentationMiddleware:
+    '''Число запросов к базе, время и размер ответа по действиям API.
+
+    Замеряется доля METRICS_SAMPLE_RATE запросов, остальные проходят
+    без обёрток. Потоковые ответы замеряются до первого байта.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrument_serializers()
+
+    def __call__(self, request):
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            return self.get_response(request)
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(stats))
+                response = self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        duration = time.perf_counter() - started
+        self.report(request, response, stats, duration)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        stats = current_stats.get()
+        if stats is None:
+            return
+        view = getattr(view_func, 'cls', None)
+        if view is None:
+            stats.action = f'{view_func.__module__}.{view_func.__name__}'
+            return
+        actions = getattr(view_func, 'actions', None) or {}
+        action = actions.get(request.method.lower(), request.method.lower())
+        stats.action = f'{view.__name__}.{action}'
+
+    def report(self, request, response, stats, duration):
+        size = 0 if response.streaming else len(response.content)
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries}"',
+            f'serializer;dur={stats.serializer_time * 1000:.1f}',
+            f'total;dur={duration * 1000:.1f}',
+        ))
+        labels = (
+            stats.action or 'unresolved',
+            request.method,
+            response.status_code,
+        )
+        registry.add(labels, stats, duration, size)
+        duplicates = stats.duplicates()
+        record = {
+            'action': labels[0],
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 1),
+            'queries': stats.queries,
+            'db_ms': round(stats.db_time * 1000, 1),
+            'serializer_ms': round(stats.serializer_time * 1000, 1),
+            'response_bytes': size,
+        }
+        if duplicates:
+            record['duplicates'] = [
+                {'count': count, 'sql': sql[:settings.METRICS_SQL_LENGTH]}
+                for sql, count in duplicates.items()
+            ]
+        logger.log(
+            logging.WARNING if duplicates else logging.INFO,
+            json.dumps(record, ensure_ascii=False),
+        )
@@ -0,0 +1,136 @@
+import csv
+import io
+
+from django.conf import settings
+from rest_framework.renderers import BaseRenderer
+
+try:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfgen import canvas
+except ImportError:
+    canvas = None
+
+
+class Echo:
+    '''Буфер для csv.writer, который сразу возвращает записанную строку'''
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListRenderer(BaseRenderer):
+    '''Список покупок в текстовом файле'''
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def format_amount(self, amount):
+        '''Без экспоненты и без обрезки до 6 значащих цифр: 1000000,
+        а не 1e+06'''
+        if float(amount).is_integer():
+            return f'{int(amount):d}'
+        return f'{amount:.6f}'.rstrip('0').rstrip('.')
+
+    def stream(self, rows):
+        for name, measurement_unit, amount in rows:
+            yield (
+                f'{name} ({measurement_unit}) - '
+                f'{self.format_amount(amount)}\n'
+            ).encode(self.charset)
+
+    def render_message(self, message):
+        return f'{message}\n'.encode(self.charset)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        '''Сам список отдаётся потоком, сюда попадают только ошибки'''
+        if isinstance(data, dict):
+            data = ' '.join(str(value) for value in data.values())
+        return self.render_message(data)
+
+
+class CsvShoppingListRenderer(ShoppingListRenderer):
+    '''Список покупок в CSV'''
+    media_type = 'text/csv'
+    format = 'csv'
+    header = ('Ингредиент', 'Единица измерения', 'Количество')
+
+    def stream(self, rows):
+        writer = csv.writer(Echo())
+        # BOM нужен, чтобы Excel открыл кириллицу без перекодирования.
+        yield '\ufeff'.encode(self.charset)
+        yield writer.writerow(self.header).encode(self.charset)
+        for name, measurement_unit, amount in rows:
+            yield writer.writerow(
+                (name, measurement_unit, self.format_amount(amount))
+            ).encode(self.charset)
+
+    def render_message(self, message):
+        return csv.writer(Echo()).writerow((message,)).encode(self.charset)
+
+
+class PdfShoppingListRenderer(ShoppingListRenderer):
+    '''Список покупок в PDF, требует reportlab'''
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    font_name = 'ShoppingListFont'
+    font_size = 12
+    margin = 50
+
+    def get_font(self):
+        if self.font_name not in pdfmetrics.getRegisteredFontNames():
+            try:
+                pdfmetrics.registerFont(
+                    TTFont(self.font_name, settings.SHOPPING_LIST_PDF_FONT)
+                )
+            except Exception:
+                return 'Helvetica'
+        return self.font_name
+
+    def build(self, lines):
+        # PDF заканчивается таблицей смещений, поэтому документ
+        # собирается целиком, а потоком читаются только строки из базы.
+        buffer = io.BytesIO()
+        document = canvas.Canvas(buffer, pagesize=A4)
+        font = self.get_font()
+        width, height = A4
+        line_height = self.font_size * 1.5
+        y = height - self.margin
+        document.setFont(font, self.font_size)
+        for line in lines:
+            if y < self.margin:
+                document.showPage()
+                document.setFont(font, self.font_size)
+                y = height - self.margin
+            document.drawString(self.margin, y, line)
+            y -= line_height
+        document.save()
+        return buffer.getvalue()
+
+    def stream(self, rows):
+        yield self.build(
+            f'{name} ({measurement_unit}) - {self.format_amount(amount)}'
+            for name, measurement_unit, amount in rows
+        )
+
+    def render_message(self, message):
+        return self.build([message])
+
+
+class PrometheusRenderer(BaseRenderer):
+    '''Показатели в текстовом формате Prometheus'''
+    media_type = 'text/plain'
+    format = 'prometheus'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            data = ' '.join(str(value) for value in data.values())
+        return data.encode(self.charset)
+
+
+SHOPPING_LIST_RENDERERS = (ShoppingListRenderer, CsvShoppingListRenderer)
+if canvas is not None:
+    SHOPPING_LIST_RENDERERS += (PdfShoppingListRenderer,)
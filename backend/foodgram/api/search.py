@@ -0,0 +1,172 @@
+import re
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, SearchVector
+)
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import Case, F, FloatField, When
+
+from recipes.models import Recipes
+from .autocomplete import normalize
+
+TOKEN_RE = re.compile(r'\w+')
+NAME_WEIGHT = 2
+TEXT_WEIGHT = 1
+
+
+class PostgresSearch:
+    '''Полнотекстовый поиск по колонке search_vector с GIN-индексом'''
+
+    def get_vector(self):
+        return (
+            SearchVector('name', weight='A', config=settings.SEARCH_CONFIG)
+            + SearchVector('text', weight='B', config=settings.SEARCH_CONFIG)
+        )
+
+    def update(self, recipes):
+        Recipes.objects.filter(pk__in=recipes).update(
+            search_vector=self.get_vector()
+        )
+
+    def remove(self, recipe_id):
+        '''Строка удаляется вместе с рецептом'''
+
+    def rebuild(self):
+        Recipes.objects.update(search_vector=self.get_vector())
+
+    def search(self, queryset, value):
+        query = SearchQuery(
+            value, config=settings.SEARCH_CONFIG, search_type='websearch'
+        )
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        ).order_by('-search_rank', '-pub_date')
+
+
+class InvertedIndexSearch:
+    '''Обратный индекс в памяти процесса для баз без полнотекстового поиска.
+
+    Морфологии нет: слова только приводятся к нижнему регистру и «ё»
+    заменяется на «е». Изменения в своём процессе применяются сразу,
+    остальные процессы пересобирают индекс по смене версии в общем кэше.
+    '''
+    version_key = 'search:inverted-index:version'
+
+    def __init__(self):
+        self.built = False
+        self.version = None
+        self.postings = defaultdict(dict)
+        self.documents = {}
+        self.lock = threading.RLock()
+
+    @property
+    def cache(self):
+        return caches[settings.DICTIONARY_CACHE]
+
+    def tokenize(self, name, text):
+        weights = defaultdict(int)
+        for weight, value in ((NAME_WEIGHT, name), (TEXT_WEIGHT, text)):
+            for token in TOKEN_RE.findall(normalize(value)):
+                weights[token] += weight
+        return weights
+
+    def index(self, recipe_id, name, text):
+        self.remove_document(recipe_id)
+        weights = self.tokenize(name, text)
+        for token, weight in weights.items():
+            self.postings[token][recipe_id] = weight
+        self.documents[recipe_id] = tuple(weights)
+
+    def remove_document(self, recipe_id):
+        for token in self.documents.pop(recipe_id, ()):
+            self.postings[token].pop(recipe_id, None)
+            if not self.postings[token]:
+                del self.postings[token]
+
+    def rebuild(self):
+        with self.lock:
+            self.postings.clear()
+            self.documents.clear()
+            for recipe_id, name, text in Recipes.objects.values_list(
+                'pk', 'name', 'text'
+            ).iterator():
+                self.index(recipe_id, name, text)
+
+    def refresh(self):
+        version = self.cache.get(self.version_key)
+        if not self.built or version != self.version:
+            with self.lock:
+                self.rebuild()
+                self.built = True
+                self.version = version
+
+    def bump_version(self):
+        '''incr атомарен: одновременные изменения двух процессов дают
+        две разные версии, и ни одно не теряется'''
+        # Начальное значение - время, чтобы после вытеснения ключа
+        # версии не повторились.
+        self.cache.add(self.version_key, time.time_ns(), None)
+        version = self.cache.incr(self.version_key)
+        if self.version == version - 1:
+            self.version = version
+
+    def update(self, recipes):
+        with self.lock:
+            if self.built:
+                for recipe_id, name, text in Recipes.objects.filter(
+                    pk__in=recipes
+                ).values_list('pk', 'name', 'text'):
+                    self.index(recipe_id, name, text)
+            self.bump_version()
+
+    def remove(self, recipe_id):
+        with self.lock:
+            self.remove_document(recipe_id)
+            self.bump_version()
+
+    def rank(self, value):
+        self.refresh()
+        tokens = set(TOKEN_RE.findall(normalize(value)))
+        if not tokens:
+            return {}
+        with self.lock:
+            postings = sorted(
+                (self.postings.get(token, {}) for token in tokens), key=len
+            )
+            scores = dict(postings[0])
+            for posting in postings[1:]:
+                scores = {
+                    recipe_id: score + posting[recipe_id]
+                    for recipe_id, score in scores.items()
+                    if recipe_id in posting
+                }
+        return scores
+
+    def search(self, queryset, value):
+        scores = self.rank(value)
+        if not scores:
+            return queryset.none()
+        return queryset.filter(pk__in=scores).annotate(
+            search_rank=Case(
+                *(
+                    When(pk=recipe_id, then=score)
+                    for recipe_id, score in scores.items()
+                ),
+                output_field=FloatField(),
+            )
+        ).order_by('-search_rank', '-pub_date')
+
+
+postgres_search = PostgresSearch()
+inverted_index_search = InvertedIndexSearch()
+
+
+def get_search_backend():
+    if connection.vendor == 'postgresql':
+        return postgres_search
+    return inverted_index_search
@@ -1,15 +1,22 @@
+from functools import partial
+
 from django.contrib.auth import get_user_model
 from django.db import transaction
 from django.conf import settings
+from django.db.models import F, Manager, Window
+from django.db.models.functions import RowNumber
 from djoser.serializers import UserSerializer
 from rest_framework import serializers, exceptions
-from drf_extra_fields.fields import Base64ImageField
 
 from recipes.models import (
-    Ingredients, Tags, Recipes, ShoppingCart,
+    Ingredients, Tags, Recipes, ShoppingCart, ShoppingCartIngredient,
     IngredientsInRecipes, Favorite
 )
 from users.models import Users, Follow
+from .cache import membership_cache, recipe_cache
+from .images import ImageRenditionsField, StreamingBase64ImageField
+from .matching import ingredient_matcher
+from .similarity import recipe_similarity
 
 
 User = get_user_model()
@@ -28,12 +35,11 @@ class CustomUserSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, obj):
-        if self.context.get('request').user.is_anonymous:
-            return False
-        return Follow.objects.filter(
-            author=obj,
-            user=self.context.get('request').user
-        ).exists()
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return membership_cache.contains(
+            self.context.get('request'), Follow, obj.pk
+        )
 
 
 class SetPasswordSerializer(serializers.Serializer):
@@ -90,7 +96,7 @@ class CreateRecipeIngredientSerializer(serializers.ModelSerializer):
 class CreateRecipeSerializer(serializers.ModelSerializer):
     '''Сериализатор создания рецепта'''
     author = CustomUserSerializer(read_only=True)
-    image = Base64ImageField()
+    image = StreamingBase64ImageField()
     tags = serializers.PrimaryKeyRelatedField(
         queryset=Tags.objects.all(),
         many=True,
@@ -128,16 +134,89 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
         )
         new_recipe.tags.set(tags)
         self.create_ingredients(new_recipe, ingredients)
+        transaction.on_commit(
+            partial(ingredient_matcher.update, [new_recipe.pk])
+        )
+        transaction.on_commit(
+            partial(recipe_similarity.update, new_recipe.pk)
+        )
         return new_recipe
 
+    def update_ingredients(self, recipe, ingredients):
+        '''Пишет только отличия от сохранённого состава рецепта'''
+        stored = {
+            row.ingredient_id: row for row in recipe.recipe_ingredients.all()
+        }
+        old_ingredients = {
+            ingredient_id: row.amount for ingredient_id, row in stored.items()
+        }
+        new_ingredients = {
+            item['id'].pk: item['amount'] for item in ingredients
+        }
+        removed = [
+            row.pk for ingredient_id, row in stored.items()
+            if ingredient_id not in new_ingredients
+        ]
+        changed = []
+        added = []
+        for ingredient_id, amount in new_ingredients.items():
+            row = stored.get(ingredient_id)
+            if row is None:
+                added.append(IngredientsInRecipes(
+                    recipe=recipe, ingredient_id=ingredient_id, amount=amount
+                ))
+            elif row.amount != amount:
+                row.amount = amount
+                changed.append(row)
+        if removed:
+            IngredientsInRecipes.objects.filter(pk__in=removed).delete()
+        if changed:
+            IngredientsInRecipes.objects.bulk_update(changed, ('amount',))
+        if added:
+            IngredientsInRecipes.objects.bulk_create(added)
+        ShoppingCartIngredient.objects.update_recipe(
+            recipe, old_ingredients, new_ingredients
+        )
+        if removed or changed or added:
+            # Ингредиенты меняются без сохранения рецепта и без сигнала.
+            recipe_cache.invalidate(f'recipe:{recipe.pk}', 'content')
+        if removed or added:
+            transaction.on_commit(
+                partial(ingredient_matcher.update, [recipe.pk])
+            )
+        return bool(removed or added)
+
+    def update_tags(self, recipe, tags):
+        stored = {tag.pk for tag in recipe.tags.all()}
+        new = {tag.pk for tag in tags}
+        if stored - new:
+            recipe.tags.remove(*(stored - new))
+        if new - stored:
+            recipe.tags.add(*(new - stored))
+        return stored != new
+
     @transaction.atomic
     def update(self, instance, validated_data):
-        ingredients = validated_data.pop("ingredients")
-        tags = validated_data.pop("tags")
-        IngredientsInRecipes.objects.filter(recipe=instance).delete()
-        self.create_ingredients(instance, ingredients)
-        instance.tags.set(tags)
-        return super().update(instance, validated_data)
+        ingredients = validated_data.pop('ingredients', None)
+        tags = validated_data.pop('tags', None)
+        changed = False
+        if ingredients is not None:
+            changed |= self.update_ingredients(instance, ingredients)
+        if tags is not None:
+            changed |= self.update_tags(instance, tags)
+        if changed:
+            transaction.on_commit(
+                partial(recipe_similarity.update, instance.pk)
+            )
+        update_fields = [
+            attr for attr, value in validated_data.items()
+            if getattr(instance, attr) != value
+        ]
+        for attr in update_fields:
+            setattr(instance, attr, validated_data[attr])
+        if update_fields:
+            instance.save(update_fields=update_fields)
+        return instance
 
     def to_representation(self, instance):
         return ReadRecipeSerializer(instance, context=self.context).data
@@ -187,46 +266,94 @@ class ReadRecipeSerializer(serializers.ModelSerializer):
     author = CustomUserSerializer(read_only=True)
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
+    image = ImageRenditionsField(rendition='full')
+    images = ImageRenditionsField()
 
     class Meta:
         model = Recipes
         fields = (
-            'id', 'tags', 'ingredients', 'author', 'name', 'image',
+            'id', 'tags', 'ingredients', 'author', 'name', 'image', 'images',
             'text', 'cooking_time', 'is_favorited', 'is_in_shopping_cart',
         )
         read_only_fields = (
-            'id', 'tags', 'ingredients', 'author', 'name', 'image', 'text',
-            'cooking_time', 'is_favorited', 'is_in_shopping_cart',
+            'id', 'tags', 'ingredients', 'author', 'name', 'image', 'images',
+            'text', 'cooking_time', 'is_favorited', 'is_in_shopping_cart',
         )
 
     def get_ingredients(self, obj):
-        ingredients = IngredientsInRecipes.objects.filter(recipe=obj)
+        ingredients = obj.recipe_ingredients.all()
         return ReadRecipeIngredientSerializer(ingredients, many=True).data
 
     def get_is_favorited(self, obj):
-        request = self.context.get('request')
-        current_user = request.user
-        if current_user.is_authenticated:
-            return Favorite.objects.filter(
-                user=current_user, recipes=obj.id).exists()
-        return False
+        return membership_cache.contains(
+            self.context.get('request'), Favorite, obj.id
+        )
 
     def get_is_in_shopping_cart(self, obj):
-        request = self.context.get('request')
-        current_user = request.user
-        if current_user.is_authenticated:
-            return ShoppingCart.objects.filter(
-                user=current_user, recipes=obj.id).exists()
-        return False
+        return membership_cache.contains(
+            self.context.get('request'), ShoppingCart, obj.id
+        )
 
 
 class SerializerForCreatedRecipes(serializers.ModelSerializer):
     '''Сериализатор короткого рецепта, для показа при успешном создании'''
+    image = ImageRenditionsField(rendition='card')
+    images = ImageRenditionsField()
+
     class Meta:
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'images', 'cooking_time')
         model = Recipes
 
 
+class BulkRecipesSerializer(serializers.Serializer):
+    '''Список id рецептов для массового добавления и удаления'''
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_RECIPES_LIMIT,
+    )
+
+    def validate_recipes(self, data):
+        return list(dict.fromkeys(data))
+
+
+class SubscriptionListSerializer(serializers.ListSerializer):
+    '''Превью рецептов для всей страницы подписок одним запросом'''
+
+    def to_representation(self, data):
+        authors = list(data.all() if isinstance(data, Manager) else data)
+        limit = self.context.get('request').GET.get('recipes_limit')
+        limit = int(limit) if limit and limit.isdigit() else None
+        previews = {}
+        for recipe in self.get_recipes_preview(authors, limit):
+            previews.setdefault(recipe.author_id, []).append(recipe)
+        for author in authors:
+            author.recipes_preview = previews.get(author.pk, [])
+        return super().to_representation(authors)
+
+    def get_recipes_preview(self, authors, limit):
+        queryset = Recipes.objects.filter(
+            author__in=[author.pk for author in authors]
+        ).only(
+            'id', 'name', 'image', 'image_renditions', 'cooking_time',
+            'author',
+        )
+        if limit is None:
+            return queryset
+        queryset = queryset.annotate(row_number=Window(
+            expression=RowNumber(),
+            partition_by=F('author'),
+            order_by=(F('pub_date').desc(), F('id').desc()),
+        )).order_by()
+        sql, params = queryset.query.sql_with_params()
+        return Recipes.objects.raw(
+            f'SELECT * FROM ({sql}) AS preview '
+            f'WHERE preview.row_number <= %s '
+            f'ORDER BY preview.row_number',
+            (*params, limit)
+        )
+
+
 class SubscriptionSerializer(serializers.ModelSerializer):
 
     recipes = serializers.SerializerMethodField()
@@ -236,26 +363,33 @@ class SubscriptionSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = (
-            'id', 'email', 'username', 'first_name', 'author',
+            'id', 'email', 'username', 'first_name',
             'last_name', 'is_subscribed', 'recipes', 'recipes_count'
         )
+        list_serializer_class = SubscriptionListSerializer
 
     def get_recipes(self, obj):
+        if hasattr(obj, 'recipes_preview'):
+            return SerializerForCreatedRecipes(
+                obj.recipes_preview, many=True, read_only=True,
+                context=self.context,
+            ).data
         recipes = obj.recipes.all()
         request = self.context.get('request')
         limit = request.GET.get('recipes_limit')
         if limit and limit.isdigit():
             recipes = recipes[:int(limit)]
         serializer = SerializerForCreatedRecipes(
-            recipes, many=True, read_only=True
+            recipes, many=True, read_only=True, context=self.context
         )
         return serializer.data
 
     def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
     def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        return Follow.objects.filter(
-            user=request.user, author=obj.pk
-        ).exists()
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return membership_cache.contains(
+            self.context.get('request'), Follow, obj.pk
+        )
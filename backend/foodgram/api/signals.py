@@ -0,0 +1,188 @@
+from functools import partial
+
+from django.db import connections, transaction
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_migrate, post_save, pre_delete, pre_save
+)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Ingredients, Recipes, SimilarRecipe, Tags
+from users.models import Users
+from .authentication import token_cache
+from .cache import ingredients_cache, recipe_cache, tags_cache
+from .images import release_image, renditions_ready, schedule_renditions
+from .matching import ingredient_matcher
+from .search import get_search_backend
+from .similarity import recipe_similarity
+
+AUTHOR_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+
+
+@receiver((post_save, post_delete), sender=Tags)
+def invalidate_tags(sender, **kwargs):
+    tags_cache.invalidate()
+
+
+@receiver((post_save, post_delete), sender=Ingredients)
+def invalidate_ingredients(sender, **kwargs):
+    ingredients_cache.invalidate()
+
+
+@receiver(post_save, sender=Recipes)
+def invalidate_recipe(sender, instance, created, **kwargs):
+    recipe_cache.invalidate(f'recipe:{instance.pk}', 'content')
+    if created:
+        recipe_cache.invalidate_lists(authors=[instance.author_id])
+
+
+@receiver(pre_delete, sender=Recipes)
+def remember_tags(sender, instance, **kwargs):
+    instance.stored_tags = list(
+        instance.tags.values_list('slug', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Recipes)
+def invalidate_deleted_recipe(sender, instance, **kwargs):
+    recipe_cache.invalidate(f'recipe:{instance.pk}')
+    recipe_cache.invalidate_lists(
+        authors=[instance.author_id],
+        tags=getattr(instance, 'stored_tags', ()),
+    )
+
+
+@receiver(m2m_changed, sender=Recipes.tags.through)
+def invalidate_recipe_tags(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    if action == 'pre_clear':
+        related = instance.tag_in_recipe if reverse else instance.tags
+        instance.cleared = list(related.values_list('pk', flat=True))
+        return
+    if action == 'post_clear':
+        pk_set = instance.cleared
+    elif action not in ('post_add', 'post_remove'):
+        return
+    if reverse:
+        recipes, tags = pk_set, [instance.slug]
+    else:
+        recipes = [instance.pk]
+        tags = Tags.objects.filter(pk__in=pk_set).values_list(
+            'slug', flat=True
+        )
+    recipe_cache.invalidate(*(f'recipe:{pk}' for pk in recipes))
+    recipe_cache.invalidate(*(f'tag-recipes:{slug}' for slug in tags))
+
+
+@receiver(post_save, sender=Users)
+def invalidate_author(sender, instance, created, update_fields=None,
+                      **kwargs):
+    # Вход обновляет только last_login, в ответах рецептов его нет.
+    if created or update_fields and not AUTHOR_FIELDS & set(update_fields):
+        return
+    recipe_cache.invalidate(f'author:{instance.pk}')
+
+
+def revoke_tokens(keys):
+    '''Сразу и ещё раз после коммита: запрос из другого потока мог
+    успеть положить в кэш процесса прочитанное до изменения'''
+    token_cache.revoke(keys)
+    transaction.on_commit(partial(token_cache.revoke, keys))
+
+
+@receiver(post_delete, sender=Token)
+def revoke_deleted_token(sender, instance, **kwargs):
+    revoke_tokens([instance.key])
+
+
+@receiver(post_save, sender=Users)
+def revoke_user_tokens(sender, instance, created, update_fields=None,
+                       **kwargs):
+    # Смена пароля, отключение и правка профиля: в кэше лежит
+    # пользователь целиком. Вход меняет только last_login.
+    if created or update_fields and set(update_fields) <= {'last_login'}:
+        return
+    keys = list(Token.objects.filter(
+        user=instance
+    ).values_list('key', flat=True))
+    if keys:
+        revoke_tokens(keys)
+
+
+@receiver(post_save, sender=Recipes)
+def update_search_index(sender, instance, update_fields=None, **kwargs):
+    if update_fields and not {'name', 'text'} & set(update_fields):
+        return
+    # После коммита: откат не оставит в индексе несуществующий рецепт, а
+    # другие процессы не пересоберут индекс по незакоммиченным строкам.
+    transaction.on_commit(
+        partial(get_search_backend().update, [instance.pk])
+    )
+
+
+@receiver(pre_save, sender=Recipes)
+def remember_image(sender, instance, update_fields=None, **kwargs):
+    if instance.pk is None or update_fields and 'image' not in update_fields:
+        return
+    instance.stored_image = Recipes.objects.filter(
+        pk=instance.pk
+    ).values_list('image', flat=True).first()
+
+
+@receiver(post_save, sender=Recipes)
+def render_image(sender, instance, update_fields=None, **kwargs):
+    if update_fields and 'image' not in update_fields:
+        return
+    stored_image = getattr(instance, 'stored_image', None)
+    if stored_image and stored_image != instance.image.name:
+        transaction.on_commit(partial(release_image, stored_image))
+    if not instance.image or renditions_ready(instance):
+        return
+    transaction.on_commit(
+        partial(schedule_renditions, instance.pk, instance.image.name)
+    )
+
+
+@receiver(post_delete, sender=Recipes)
+def remove_from_search_index(sender, instance, **kwargs):
+    transaction.on_commit(partial(get_search_backend().remove, instance.pk))
+
+
+@receiver(post_delete, sender=Recipes)
+def remove_from_ingredient_index(sender, instance, **kwargs):
+    transaction.on_commit(partial(ingredient_matcher.remove, instance.pk))
+
+
+@receiver(pre_delete, sender=Recipes)
+def remember_similar(sender, instance, **kwargs):
+    instance.similar_to = list(SimilarRecipe.objects.filter(
+        similar=instance
+    ).values_list('recipe_id', flat=True))
+
+
+@receiver(post_delete, sender=Recipes)
+def refill_similar(sender, instance, **kwargs):
+    '''Строки с удалённым рецептом ушли каскадом, и списки его соседей
+    стали короче: они пересчитываются после удаления из индекса'''
+    similar_to = getattr(instance, 'similar_to', None)
+    if similar_to:
+        transaction.on_commit(partial(recipe_similarity.refill, similar_to))
+
+
+@receiver(post_delete, sender=Recipes)
+def remove_image(sender, instance, **kwargs):
+    if instance.image:
+        transaction.on_commit(partial(release_image, instance.image.name))
+
+
+@receiver(post_migrate)
+def create_search_index(sender, using, **kwargs):
+    '''GIN-индекс создаётся здесь: миграции с ним не применятся в SQLite'''
+    connection = connections[using]
+    if sender.label != 'recipes' or connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS recipes_search_vector_gin '
+            'ON recipes_recipes USING gin (search_vector)'
+        )
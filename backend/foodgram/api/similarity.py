@@ -0,0 +1,213 @@
+import heapq
+import math
+from collections import Counter, defaultdict
+from itertools import chain
+
+from django.conf import settings
+from django.db import transaction
+
+from recipes.models import IngredientsInRecipes, Recipes, SimilarRecipe
+from .matching import ingredient_matcher
+
+
+class RecipeSimilarity:
+    '''Похожие рецепты по косинусной близости разреженных векторов.
+
+    Вектор рецепта - ингредиенты с весом idf и теги с постоянным весом.
+    Кандидаты берутся из обратного индекса ingredient_matcher по самым
+    редким ингредиентам рецепта, точная близость считается только для
+    кандидатов с наибольшим числом общих ингредиентов.
+    '''
+
+    def features(self, recipes):
+        '''{recipe_id: (ингредиенты, теги)} для списка рецептов'''
+        features = defaultdict(lambda: (set(), set()))
+        for recipe_id, ingredient_id in IngredientsInRecipes.objects.filter(
+            recipe__in=recipes
+        ).values_list('recipe_id', 'ingredient_id'):
+            features[recipe_id][0].add(ingredient_id)
+        for recipe_id, tag_id in Recipes.tags.through.objects.filter(
+            recipes__in=recipes
+        ).values_list('recipes_id', 'tags_id'):
+            features[recipe_id][1].add(tag_id)
+        return features
+
+    def vector(self, features):
+        postings = ingredient_matcher.postings
+        total = max(len(ingredient_matcher.sizes), 1)
+        ingredients, tags = features
+        vector = {
+            ('ingredient', ingredient_id): math.log(
+                1 + total / max(len(postings.get(ingredient_id, ())), 1)
+            )
+            for ingredient_id in ingredients
+        }
+        vector.update(
+            (('tag', tag_id), settings.SIMILAR_TAG_WEIGHT) for tag_id in tags
+        )
+        return vector
+
+    def cosine(self, first, second):
+        if len(first) > len(second):
+            first, second = second, first
+        dot = sum(
+            weight * second[feature]
+            for feature, weight in first.items() if feature in second
+        )
+        if not dot:
+            return 0
+        return dot / math.sqrt(
+            sum(w * w for w in first.values())
+            * sum(w * w for w in second.values())
+        )
+
+    def candidates(self, recipe_id, ingredients):
+        '''Рецепты с наибольшим числом общих редких ингредиентов'''
+        postings = ingredient_matcher.postings
+        total = max(len(ingredient_matcher.sizes), 1)
+        limit = settings.SIMILAR_MAX_DF * total
+        ranked = sorted(
+            (postings[ingredient_id] for ingredient_id in ingredients
+             if ingredient_id in postings),
+            key=len,
+        )
+        # Соль есть почти везде: по ней кандидатов не ищем, но самые
+        # редкие ингредиенты берём всегда, даже если они частые.
+        chosen = [
+            posting for position, posting in enumerate(ranked)
+            if position < settings.SIMILAR_MIN_FEATURES
+            or len(posting) <= limit
+        ]
+        overlap = Counter(chain.from_iterable(chosen))
+        overlap.pop(recipe_id, None)
+        return [
+            candidate for candidate, _ in overlap.most_common(
+                settings.SIMILAR_CANDIDATES
+            )
+        ]
+
+    def neighbours(self, recipe_id, features, vectors):
+        vector = self.vector(features)
+        scores = (
+            (self.cosine(vector, vectors[candidate]), candidate)
+            for candidate in self.candidates(recipe_id, features[0])
+            if candidate in vectors
+        )
+        return [
+            (candidate, score) for score, candidate in heapq.nlargest(
+                settings.SIMILAR_RECIPES_COUNT, scores
+            ) if score > 0
+        ]
+
+    def rebuild(self, batch_size=1000):
+        '''Пересчитывает соседей всех рецептов, возвращает число строк'''
+        ingredient_matcher.refresh()
+        features = self.features(Recipes.objects.all())
+        vectors = {
+            recipe_id: self.vector(recipe_features)
+            for recipe_id, recipe_features in features.items()
+        }
+        created = 0
+        batch = []
+        with transaction.atomic():
+            SimilarRecipe.objects.all().delete()
+            for recipe_id, recipe_features in features.items():
+                batch.extend(
+                    SimilarRecipe(
+                        recipe_id=recipe_id, similar_id=candidate, score=score
+                    )
+                    for candidate, score in self.neighbours(
+                        recipe_id, recipe_features, vectors
+                    )
+                )
+                if len(batch) >= batch_size:
+                    SimilarRecipe.objects.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+            SimilarRecipe.objects.bulk_create(batch)
+        return created + len(batch)
+
+    def recompute(self, recipes):
+        '''Заново считает и сохраняет соседей рецептов'''
+        features = self.features(recipes)
+        candidates = {
+            recipe_id: self.candidates(recipe_id, features[recipe_id][0])
+            for recipe_id in recipes if recipe_id in features
+        }
+        features.update(self.features(
+            set(chain.from_iterable(candidates.values())) - set(features)
+        ))
+        vectors = {
+            recipe_id: self.vector(recipe_features)
+            for recipe_id, recipe_features in features.items()
+        }
+        SimilarRecipe.objects.filter(recipe__in=recipes).delete()
+        SimilarRecipe.objects.bulk_create(
+            SimilarRecipe(
+                recipe_id=recipe_id, similar_id=candidate, score=score
+            )
+            for recipe_id in candidates
+            for candidate, score in self.neighbours(
+                recipe_id, features[recipe_id], vectors
+            )
+        )
+
+    @transaction.atomic
+    def refill(self, recipes):
+        '''Пересчитывает списки рецептов, у которых удалили соседа'''
+        ingredient_matcher.refresh()
+        self.recompute(recipes)
+
+    @transaction.atomic
+    def update(self, recipe_id):
+        '''Обновляет соседей рецепта и вставляет его в списки соседей'''
+        ingredient_matcher.refresh()
+        features = self.features([recipe_id])
+        if recipe_id not in features:
+            return
+        candidates = self.candidates(recipe_id, features[recipe_id][0])
+        features.update(self.features(candidates))
+        vectors = {
+            candidate: self.vector(features[candidate])
+            for candidate in candidates if candidate in features
+        }
+        neighbours = self.neighbours(recipe_id, features[recipe_id], vectors)
+        # Рецепты, у которых он был среди похожих, без него остаются
+        # с неполным списком: тех, к кому он не вернётся ниже,
+        # пересчитываем.
+        affected = set(SimilarRecipe.objects.filter(
+            similar_id=recipe_id
+        ).values_list('recipe_id', flat=True))
+        SimilarRecipe.objects.filter(recipe_id=recipe_id).delete()
+        SimilarRecipe.objects.filter(similar_id=recipe_id).delete()
+        SimilarRecipe.objects.bulk_create(
+            SimilarRecipe(
+                recipe_id=recipe_id, similar_id=candidate, score=score
+            ) for candidate, score in neighbours
+        )
+        # Рецепт попадает к соседям, если близок им не меньше, чем
+        # последний из их текущих похожих.
+        stored = defaultdict(list)
+        for other, score in SimilarRecipe.objects.filter(
+            recipe__in=[candidate for candidate, _ in neighbours]
+        ).values_list('recipe_id', 'score'):
+            stored[other].append(score)
+        for candidate, score in neighbours:
+            scores = sorted(stored[candidate], reverse=True)
+            if len(scores) < settings.SIMILAR_RECIPES_COUNT:
+                SimilarRecipe.objects.create(
+                    recipe_id=candidate, similar_id=recipe_id, score=score
+                )
+            elif score > scores[-1]:
+                SimilarRecipe.objects.filter(
+                    recipe_id=candidate, score__lte=scores[-1]
+                ).order_by('score', 'id').first().delete()
+                SimilarRecipe.objects.create(
+                    recipe_id=candidate, similar_id=recipe_id, score=score
+                )
+        affected.difference_update(candidate for candidate, _ in neighbours)
+        if affected:
+            self.recompute(affected)
+
+
+recipe_similarity = RecipeSimilarity()
@@ -2,7 +2,7 @@ from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
 from .views import (IngredientsViewSet, CustomUserViewset,
-                    TagsViewSet, RecipesViewSet,
+                    MetricsView, TagsViewSet, RecipesViewSet,
                     )
 
 router = DefaultRouter()
@@ -12,6 +12,7 @@ router.register('recipes', RecipesViewSet, basename='recipes')
 router.register('ingredients', IngredientsViewSet, basename='ingredients')
 
 urlpatterns = [
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path('', include(router.urls)),
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
@@ -0,0 +1,77 @@
+import gzip
+
+from django.db import connections, router
+from django.db.models.sql import InsertQuery
+
+
+def insert_ignore(instance):
+    '''Один INSERT ... ON CONFLICT DO NOTHING вместо exists() и create().
+
+    Возвращает True, если строка вставлена, и False, если такая уже есть.
+    Сигналы save не отправляются.
+    '''
+    model = type(instance)
+    using = router.db_for_write(model)
+    fields = [
+        field for field in model._meta.local_concrete_fields
+        if not field.primary_key
+    ]
+    query = InsertQuery(model, ignore_conflicts=True)
+    query.insert_values(fields, [instance])
+    inserted = 0
+    with connections[using].cursor() as cursor:
+        for sql, params in query.get_compiler(using=using).as_sql():
+            cursor.execute(sql, params)
+            inserted += cursor.rowcount
+    return inserted > 0
+
+
+def bulk_insert(model, names, rows, ignore_conflicts=False, returning=None):
+    '''Многострочный INSERT из кортежей значений, без экземпляров модели.
+
+    В отличие от bulk_create не вызывает pre_save, поэтому auto_now_add
+    не затирает переданные даты. Значения по умолчанию не подставляются.
+    С returning возвращает значения этого поля у вставленных строк:
+    строки, пропущенные из-за ignore_conflicts, в ответ не попадают.
+    '''
+    using = router.db_for_write(model)
+    connection = connections[using]
+    fields = [model._meta.get_field(name) for name in names]
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = ', '.join(
+        connection.ops.quote_name(field.column) for field in fields
+    )
+    insert = connection.ops.insert_statement(ignore_conflicts=ignore_conflicts)
+    suffix = connection.ops.ignore_conflicts_suffix_sql(
+        ignore_conflicts=ignore_conflicts
+    )
+    if returning is not None:
+        suffix += ' RETURNING ' + connection.ops.quote_name(
+            model._meta.get_field(returning).column
+        )
+    batch_size = max(connection.ops.bulk_batch_size(fields, rows), 1)
+    returned = []
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            values = connection.ops.bulk_insert_sql(
+                fields, [['%s'] * len(fields)] * len(batch)
+            )
+            cursor.execute(
+                f'{insert} {table} ({columns}) {values} {suffix}',
+                [
+                    field.get_db_prep_save(value, connection)
+                    for row in batch
+                    for field, value in zip(fields, row)
+                ],
+            )
+            if returning is not None:
+                returned.extend(value for value, in cursor.fetchall())
+    return returned
+
+
+def open_dataset(path, mode):
+    '''Файл выгрузки в JSON Lines, .gz сжимается на лету'''
+    if path.endswith('.gz'):
+        return gzip.open(path, f'{mode}t', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
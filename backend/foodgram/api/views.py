@@ -1,27 +1,42 @@
+from functools import partial
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import BooleanField, Prefetch, Value
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import status, exceptions, mixins, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import (
-    IsAuthenticated, AllowAny, IsAuthenticatedOrReadOnly
+    IsAuthenticated, AllowAny, IsAdminUser, IsAuthenticatedOrReadOnly
 )
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
 from recipes.models import (
-    Ingredients, IngredientsInRecipes, Recipes, ShoppingCart, Tags, Favorite
+    FeedEntry, Ingredients, IngredientsInRecipes, Recipes, ShoppingCart,
+    ShoppingCartIngredient, SimilarRecipe, Tags, Favorite, change_counter
 )
 from users.models import Users, Follow
-from .filters import IngredientsFilter, RecipeFilter
+from .cache import (
+    CachedDictionaryMixin, CachedRecipesMixin, ingredients_cache,
+    membership_cache, recipe_cache, tags_cache
+)
+from .autocomplete import ingredient_index
+from .filters import ORDERINGS, IngredientsFilter, RecipeFilter
 from .serializers import (
     IngredientsSerializer, TagsSerializer,
     SerializerForCreatedRecipes, ReadRecipeSerializer, CreateRecipeSerializer,
-    SubscriptionSerializer
+    SubscriptionSerializer, BulkRecipesSerializer
 )
-from .pagination import NumberPerPage
+from .pagination import CursorPerPage, FeedPagination, NumberPerPage
+from .metrics import registry
+from .renderers import SHOPPING_LIST_RENDERERS, PrometheusRenderer
+from .utils import bulk_insert, insert_ignore
 
 User = get_user_model()
 
@@ -30,18 +45,34 @@ class ListViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
     pass
 
 
-class TagsViewSet(viewsets.ReadOnlyModelViewSet):
+class TagsViewSet(CachedDictionaryMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Tags.objects.all()
     serializer_class = TagsSerializer
     pagination_class = None
     permission_classes = (IsAuthenticatedOrReadOnly,)
+    dictionary_cache = tags_cache
 
 
-class IngredientsViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientsViewSet(
+    CachedDictionaryMixin, viewsets.ReadOnlyModelViewSet
+):
     queryset = Ingredients.objects.all()
     serializer_class = IngredientsSerializer
     pagination_class = None
     filterset_class = IngredientsFilter
+    dictionary_cache = ingredients_cache
+
+    def list(self, request, *args, **kwargs):
+        # Пустой ?name= - это весь справочник, а не 50 подсказок.
+        if not request.query_params.get('name', '').strip():
+            return super().list(request, *args, **kwargs)
+        return self.cached_response(self.search, request, *args, **kwargs)
+
+    def search(self, request, *args, **kwargs):
+        '''Подсказки строятся из индекса в памяти, без запроса к базе'''
+        return Response(
+            ingredient_index.search(request.query_params['name'])
+        )
 
 
 class CustomUserViewset(UserViewSet):
@@ -52,10 +83,13 @@ class CustomUserViewset(UserViewSet):
         detail=False,
         methods=('get',),
         serializer_class=SubscriptionSerializer,
-        permission_classes=(IsAuthenticated, )
+        permission_classes=(IsAuthenticated, ),
+        pagination_class=CursorPerPage,
     )
     def subscriptions(self, request):
-        queryset = Users.objects.filter(author__user=request.user)
+        queryset = Users.objects.filter(author__user=request.user).annotate(
+            is_subscribed=Value(True, output_field=BooleanField()),
+        )
         pagination = self.paginate_queryset(queryset)
         serializer = SubscriptionSerializer(
             pagination, many=True,
@@ -76,53 +110,73 @@ class CustomUserViewset(UserViewSet):
         methods=('post', 'delete'),
         serializer_class=SubscriptionSerializer
     )
+    @transaction.atomic
     def subscribe(self, request, id=None):
         user = self.request.user
-        author = get_object_or_404(User, pk=id)
 
         if self.request.method == 'POST':
+            author = get_object_or_404(User, pk=id)
             if user == author:
                 raise exceptions.ValidationError(
                     'Нельзя подписаться на самого себя'
                 )
-            if Follow.objects.filter(
-                user=user,
-                author=author
-            ).exists():
+            if not insert_ignore(Follow(user=user, author=author)):
                 raise exceptions.ValidationError('Вы подписались ранее!')
+            change_counter(
+                Users.objects.filter(pk=author.pk), 'followers_count', 1
+            )
+            FeedEntry.objects.follow(user, author.pk)
+            membership_cache.add(user, Follow, [author.pk])
+            # Множества подписок обновятся только после коммита.
+            author.is_subscribed = True
 
-            Follow.objects.create(user=user, author=author)
             serializer = self.get_serializer(author)
 
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         if self.request.method == 'DELETE':
-            if not Follow.objects.filter(
+            deleted, _ = Follow.objects.filter(
                 user=user,
-                author=author
-            ).exists():
+                author_id=id
+            ).delete()
+            if not deleted:
+                get_object_or_404(User, pk=id)
                 raise exceptions.ValidationError(
                     'Вы отписались'
                 )
-
-            subscription = get_object_or_404(
-                Follow,
-                user=user,
-                author=author
+            change_counter(
+                Users.objects.filter(pk=id), 'followers_count', -deleted
             )
-            subscription.delete()
+            FeedEntry.objects.unfollow(user, id)
+            membership_cache.remove(user, Follow, [id])
 
             return Response(status=status.HTTP_204_NO_CONTENT)
 
         return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
-class RecipesViewSet(viewsets.ModelViewSet):
+class RecipesViewSet(CachedRecipesMixin, viewsets.ModelViewSet):
     queryset = Recipes.objects.all()
     serializer_class = CreateRecipeSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = RecipeFilter
     permission_classes = (AllowAny,)
+    pagination_class = CursorPerPage
+    ordering_fields = ORDERINGS
+
+    def get_queryset(self):
+        '''Фиксированное число запросов на страницу рецептов'''
+        return Recipes.objects.defer('search_vector').select_related(
+            'author'
+        ).prefetch_related(
+            'tags',
+            Prefetch(
+                'recipe_ingredients',
+                queryset=IngredientsInRecipes.objects.select_related(
+                    'ingredient'
+                )
+            ),
+        )
 
     def get_serializer_class(self):
         if self.request.method in ('POST', 'PATCH'):
@@ -131,11 +185,19 @@ class RecipesViewSet(viewsets.ModelViewSet):
 
     def add_to(self, model, request, pk):
         user = self.request.user
-        recipe = get_object_or_404(Recipes, pk=pk)
-        if model.objects.filter(user=user, recipes=recipe
-                                ).exists():
+        recipe = get_object_or_404(
+            Recipes.objects.only(
+                'id', 'name', 'image', 'image_renditions', 'cooking_time'
+            ),
+            pk=pk
+        )
+        if not insert_ignore(model(user=user, recipes=recipe)):
             raise exceptions.ValidationError('Рецепт уже в избранном.')
-        model.objects.create(user=user, recipes=recipe)
+        change_counter(
+            Recipes.objects.filter(pk=recipe.pk), model.recipe_counter, 1
+        )
+        recipe_cache.invalidate(f'field:{model.recipe_counter}')
+        membership_cache.add(user, model, [recipe.pk])
         serializer = SerializerForCreatedRecipes(
             recipe, context={'request': request}
         )
@@ -143,14 +205,17 @@ class RecipesViewSet(viewsets.ModelViewSet):
 
     def delete_from(self, model, request, pk):
         user = self.request.user
-        recipe = get_object_or_404(Recipes, pk=pk)
-        if not model.objects.filter(user=user, recipes=recipe
-                                    ).exists():
+        deleted, _ = model.objects.filter(user=user, recipes_id=pk).delete()
+        if not deleted:
+            get_object_or_404(Recipes, pk=pk)
             raise exceptions.ValidationError(
                 'Рецепта нет в избранном, либо он уже удален.'
             )
-        favorite = get_object_or_404(model, user=user, recipes=recipe)
-        favorite.delete()
+        change_counter(
+            Recipes.objects.filter(pk=pk), model.recipe_counter, -deleted
+        )
+        recipe_cache.invalidate(f'field:{model.recipe_counter}')
+        membership_cache.remove(user, model, [pk])
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -159,11 +224,12 @@ class RecipesViewSet(viewsets.ModelViewSet):
         url_path='favorite',
         permission_classes=[IsAuthenticated]
     )
+    @transaction.atomic
     def favorite(self, request, pk):
         if request.method == 'POST':
             return self.add_to(Favorite, request, pk)
         elif request.method == 'DELETE':
-            return self.delete_from(Favorite, request.user.id, pk)
+            return self.delete_from(Favorite, request, pk)
 
     @action(
         detail=True,
@@ -171,28 +237,194 @@ class RecipesViewSet(viewsets.ModelViewSet):
         url_path='shopping_cart',
         permission_classes=[IsAuthenticated]
     )
+    @transaction.atomic
     def shopping_cart(self, request, pk):
         if request.method == 'POST':
-            return self.add_to(ShoppingCart, request, pk)
+            response = self.add_to(ShoppingCart, request, pk)
+            ShoppingCartIngredient.objects.add_recipes(request.user, [pk])
+            return response
         elif request.method == 'DELETE':
-            return self.delete_from(ShoppingCart, request.user.id, pk)
+            response = self.delete_from(ShoppingCart, request, pk)
+            ShoppingCartIngredient.objects.remove_recipes(request.user, [pk])
+            return response
+
+    def get_bulk_recipes(self, request):
+        serializer = BulkRecipesSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['recipes']
+
+    def bulk_add_to(self, model, request):
+        user = request.user
+        recipes = self.get_bulk_recipes(request)
+        found = set(Recipes.objects.filter(
+            pk__in=recipes
+        ).values_list('pk', flat=True))
+        # Один INSERT ... ON CONFLICT DO NOTHING RETURNING: добавленными
+        # считаются только реально вставленные строки, и параллельный
+        # запрос с теми же рецептами не увеличит счётчики второй раз.
+        now = timezone.now()
+        inserted = set(bulk_insert(
+            model, ('user', 'recipes', 'created'),
+            [(user.pk, pk, now) for pk in recipes if pk in found],
+            ignore_conflicts=True, returning='recipes',
+        ))
+        added = [pk for pk in recipes if pk in inserted]
+        change_counter(
+            Recipes.objects.filter(pk__in=added), model.recipe_counter, 1
+        )
+        if added:
+            recipe_cache.invalidate(f'field:{model.recipe_counter}')
+        membership_cache.add(user, model, added)
+        added = set(added)
+        return Response([
+            {
+                'id': pk,
+                'status': (
+                    'not_found' if pk not in found
+                    else 'added' if pk in added
+                    else 'exists'
+                ),
+            }
+            for pk in recipes
+        ])
+
+    def bulk_delete_from(self, model, request, recipes=None):
+        user = request.user
+        entries = model.objects.filter(user=user)
+        if recipes is not None:
+            entries = entries.filter(recipes__in=recipes)
+        # Блокировка строк: параллельное удаление тех же записей
+        # дождётся коммита и не уменьшит счётчики второй раз.
+        present = list(
+            entries.select_for_update().values_list('recipes_id', flat=True)
+        )
+        entries.delete()
+        change_counter(
+            Recipes.objects.filter(pk__in=present), model.recipe_counter, -1
+        )
+        if present:
+            recipe_cache.invalidate(f'field:{model.recipe_counter}')
+        membership_cache.remove(user, model, present)
+        if recipes is None:
+            recipes = present
+        present = set(present)
+        return Response([
+            {'id': pk, 'status': 'removed' if pk in present else 'absent'}
+            for pk in recipes
+        ])
+
+    @action(
+        detail=False,
+        methods=('POST', 'DELETE'),
+        url_path='favorite',
+        url_name='bulk-favorite',
+        permission_classes=[IsAuthenticated]
+    )
+    @transaction.atomic
+    def bulk_favorite(self, request):
+        """"Добавление и удаление списка рецептов в избранном"""
+        if request.method == 'POST':
+            return self.bulk_add_to(Favorite, request)
+        return self.bulk_delete_from(
+            Favorite, request, self.get_bulk_recipes(request)
+        )
+
+    @action(
+        detail=False,
+        methods=('POST', 'DELETE'),
+        url_path='shopping_cart',
+        url_name='bulk-shopping-cart',
+        permission_classes=[IsAuthenticated]
+    )
+    @transaction.atomic
+    def bulk_shopping_cart(self, request):
+        """"Список рецептов в корзине; DELETE без recipes очищает корзину"""
+        if request.method == 'POST':
+            response = self.bulk_add_to(ShoppingCart, request)
+        elif 'recipes' in request.data:
+            response = self.bulk_delete_from(
+                ShoppingCart, request, self.get_bulk_recipes(request)
+            )
+        else:
+            response = self.bulk_delete_from(ShoppingCart, request)
+        ShoppingCartIngredient.objects.rebuild([request.user.pk])
+        return response
 
     @action(
         detail=False,
         permission_classes=[IsAuthenticated],
-        methods=['get']
+        methods=['get'],
+        renderer_classes=SHOPPING_LIST_RENDERERS,
     )
     def download_shopping_cart(self, request):
-        """"Вывод списка покупок в текстовый файл"""
-        user = request.user
-        ingredient_filter = IngredientsInRecipes.objects.filter(
-            recipe__shopping_cart__user=user
-        ).values('ingredient__name').annotate(total_amount=Sum('amount'))
-        shopping_list = [(f"{item['ingredient__name']}"
-                          f" - {item['total_amount']}"
-                          f" \n") for item in ingredient_filter]
-        response = HttpResponse(shopping_list, 'Content-Type: text/plain')
+        """"Вывод списка покупок в файл: ?format=txt|csv|pdf"""
+        ingredients = ShoppingCartIngredient.objects.filter(
+            user=request.user
+        ).values_list(
+            'ingredient__name', 'ingredient__measurement_unit', 'amount'
+        ).order_by('ingredient__name', 'ingredient__measurement_unit')
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients.iterator(
+                chunk_size=settings.SHOPPING_LIST_CHUNK_SIZE
+            )),
+            content_type=(
+                f'{renderer.media_type}; charset={renderer.charset}'
+                if renderer.charset else renderer.media_type
+            )
+        )
         response['Content-Disposition'] = (
-            'attachment; filename="shopping_list.txt"'
+            f'attachment; filename="shopping_list.{renderer.format}"'
         )
         return response
+
+    @action(
+        detail=False,
+        methods=('get',),
+        permission_classes=(IsAuthenticated,),
+        pagination_class=FeedPagination,
+    )
+    def feed(self, request):
+        '''Рецепты авторов из подписок, новые сверху'''
+        page = self.paginator.paginate_feed(
+            partial(FeedEntry.objects.page, request.user), request, Recipes
+        )
+        recipes = self.get_queryset().in_bulk([item.id for item in page])
+        serializer = ReadRecipeSerializer(
+            [recipes[item.id] for item in page if item.id in recipes],
+            many=True,
+            context=self.get_serializer_context(),
+        )
+        return self.paginator.get_paginated_response(serializer.data)
+
+    @action(
+        detail=True,
+        methods=('get',),
+        permission_classes=(AllowAny,),
+        pagination_class=None,
+    )
+    def similar(self, request, pk):
+        '''Похожие рецепты, посчитанные заранее'''
+        get_object_or_404(Recipes.objects.only('id'), pk=pk)
+        similar = list(SimilarRecipe.objects.filter(
+            recipe_id=pk
+        ).order_by('-score').values_list(
+            'similar_id', flat=True
+        )[:settings.SIMILAR_RECIPES_COUNT])
+        recipes = self.get_queryset().in_bulk(similar)
+        serializer = ReadRecipeSerializer(
+            [recipes[recipe_id] for recipe_id in similar
+             if recipe_id in recipes],
+            many=True,
+            context=self.get_serializer_context(),
+        )
+        return Response(serializer.data)
+
+
+class MetricsView(APIView):
+    '''Показатели запросов этого процесса для Prometheus'''
+    permission_classes = (IsAdminUser,)
+    renderer_classes = (PrometheusRenderer,)
+
+    def get(self, request):
+        return Response(registry.render())
@@ -39,7 +39,7 @@ REST_FRAMEWORK = {
 
     'DEFAULT_AUTHENTICATION_CLASSES': (
 
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
 
     ),
 
@@ -73,6 +73,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.metrics.InstrumentationMiddleware',
 ]
 
 ROOT_URLCONF = 'foodgram.urls'
@@ -110,6 +111,16 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', default=''),
+    }
+}
+
 # DATABASES = {
 #     'default': {
 #         'ENGINE': 'django.db.backends.sqlite3',
@@ -169,3 +180,109 @@ TAG_ERROR = 'Рецепт не может быть без тегов!'
 MIN_INGREDIENT_AMOUNT_ERROR = (
     'Количество ингредиентов не может быть меньше 1!'
 )
+SHOPPING_LIST_CHUNK_SIZE = 2000
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+# Версии справочников хранятся в этом кэше: при нескольких процессах
+# gunicorn он должен быть общим (memcached), иначе каждый процесс
+# узнает об изменениях только из своих сигналов.
+DICTIONARY_CACHE = 'default'
+DICTIONARY_CACHE_TIMEOUT = 60 * 60 * 24
+DICTIONARY_CACHE_LOCAL_SIZE = 512
+# Ответы рецептов для анонимов, хранятся в DICTIONARY_CACHE.
+RECIPE_CACHE_TIMEOUT = 60 * 60
+# Избранное, корзина и подписки пользователей в памяти процесса.
+MEMBERSHIP_CACHE_SIZE = 5000
+MEMBERSHIP_CACHE_TIMEOUT = 5 * 60
+# Токен -> пользователь; пустой TOKEN_CACHE - только память процесса.
+TOKEN_CACHE = os.getenv('TOKEN_CACHE', default='default')
+TOKEN_CACHE_TIMEOUT = 5 * 60
+TOKEN_CACHE_LOCAL_TIMEOUT = 5
+TOKEN_CACHE_LOCAL_SIZE = 10000
+TOKEN_CACHE_REVOKED_TIMEOUT = 60
+SEARCH_CONFIG = 'russian'
+# Подсказок ингредиентов в одном ответе.
+INGREDIENT_SEARCH_LIMIT = 50
+BULK_RECIPES_LIMIT = 100
+# Превью картинок рецептов: имя -> (ширина, высота) вписанного кадра.
+IMAGE_RENDITIONS = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+    'full': (1280, 1280),
+}
+IMAGE_RENDITION_FORMAT = 'WEBP'
+IMAGE_RENDITION_QUALITY = 80
+# 0 - превью считаются прямо в процессе gunicorn, для отладки.
+IMAGE_PIPELINE_WORKERS = int(os.getenv('IMAGE_PIPELINE_WORKERS', default=2))
+IMAGE_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+IMAGE_DECODE_CHUNK_SIZE = 64 * 1024
+# Столько секунд после загрузки файл не удаляется, даже если на него
+# ещё не ссылается ни один рецепт.
+MEDIA_GC_GRACE_PERIOD = 60 * 60
+IMAGE_TOO_LARGE_ERROR = 'Размер изображения не может превышать 10 МБ!'
+# Рецепты авторов с таким числом подписчиков не раскладываются
+# по лентам при публикации, а подмешиваются в ленту при чтении.
+FEED_FANOUT_LIMIT = 1000
+FEED_BATCH_SIZE = 1000
+# Вклад добавления в избранное или корзину в trending_score
+# убывает вдвое за TRENDING_HALF_LIFE, добавления старше
+# TRENDING_WINDOW не учитываются.
+TRENDING_HALF_LIFE = 60 * 60 * 24 * 3
+TRENDING_WINDOW = 60 * 60 * 24 * 30
+TRENDING_FAVORITE_WEIGHT = 1.0
+TRENDING_SHOPPING_CART_WEIGHT = 0.5
+# Оценка, изменившаяся меньше чем на эту долю, не перезаписывается:
+# затухание меняет все оценки при каждом пересчёте.
+TRENDING_MIN_CHANGE = 0.01
+# Поиск по имеющимся ингредиентам: сколько ингредиентов рецепта
+# может не хватать по умолчанию и сколько рецептов отдаётся.
+MATCH_MAX_MISSING = 2
+MATCH_RESULTS_LIMIT = 500
+# Журнал изменений индекса ингредиентов: сколько хранится запись и на
+# сколько версий процесс может отстать, чтобы догнать индекс по
+# журналу, а не пересобирать его целиком.
+MATCHING_CHANGES_TIMEOUT = 60 * 60
+MATCHING_MAX_CHANGES = 1000
+# Похожие рецепты: сколько хранить на рецепт, вес тега против
+# ингредиента с весом idf, и как отбирать кандидатов. Ингредиенты,
+# которые есть больше чем в SIMILAR_MAX_DF доле рецептов, кандидатов
+# не дают, кроме SIMILAR_MIN_FEATURES самых редких в рецепте.
+SIMILAR_RECIPES_COUNT = 6
+SIMILAR_TAG_WEIGHT = 0.5
+SIMILAR_CANDIDATES = 100
+SIMILAR_MAX_DF = 0.05
+SIMILAR_MIN_FEATURES = 2
+# Загрузка ингредиентов: сколько строк сохранять за раз и какими
+# кусками читать JSON.
+IMPORT_BATCH_SIZE = 5000
+IMPORT_READ_CHUNK_SIZE = 64 * 1024
+# Замеры запросов: доля замеряемых запросов (0 - выключено), сколько
+# одинаковых SQL в одном запросе считать N+1 и границы гистограммы
+# времени ответа в секундах.
+METRICS_SAMPLE_RATE = float(os.getenv('METRICS_SAMPLE_RATE', default=0))
+METRICS_DUPLICATE_THRESHOLD = 3
+METRICS_SQL_LENGTH = 300
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+# Пароль пользователей generate_synthetic_data, им же входит benchmark_api.
+SYNTHETIC_PASSWORD = os.getenv('SYNTHETIC_PASSWORD', default='synthetic-pass')
+# benchmark_api --compare подсвечивает замедление p50 больше чем на
+# столько процентов.
+BENCHMARK_REGRESSION_PERCENT = 20
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'api.metrics': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
@@ -19,7 +19,7 @@ class IngredientsAdmin(admin.ModelAdmin):
 
 
 class RecipesAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author',)
+    list_display = ('name', 'author', 'favorites_count',)
     search_fields = ('author', 'name', 'tags',)
     list_filter = ('author', 'name', 'tags',)
     readonly_fields = ('count_add_to_favorite',)
@@ -27,7 +27,7 @@ class RecipesAdmin(admin.ModelAdmin):
     inlines = (IngredientInRecipeInline,)
 
     def count_add_to_favorite(self, instance):
-        return instance.favorites.count()
+        return instance.favorites_count
 
 
 admin.site.register(Tags)
@@ -1,8 +1,23 @@
+import heapq
+from collections import namedtuple
+
 from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import RegexValidator, MinValueValidator
 from django.db import models
+from django.utils import timezone
+from django.db.models.functions import Greatest
+
+from users.models import Follow, Users
+from .storage import content_storage
 
-from users.models import Users
+
+def change_counter(queryset, field, delta):
+    '''Атомарно сдвигает счётчик, не опуская его ниже нуля'''
+    if delta:
+        queryset.update(**{
+            field: Greatest(models.F(field) + delta, 0)
+        })
 
 
 class Tags(models.Model):
@@ -80,8 +95,16 @@ class Recipes(models.Model):
     )
     image = models.ImageField(
         upload_to='recipes/media/',
+        storage=content_storage,
+        db_index=True,
         verbose_name='Изображение блюда'
     )
+    image_renditions = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='превью изображения',
+    )
     text = models.TextField(
         verbose_name='описание рецепта'
     )
@@ -103,11 +126,49 @@ class Recipes(models.Model):
         auto_now_add=True,
         verbose_name='дата создания рецепта'
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='в избранном',
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='в корзинах',
+    )
+    trending_score = models.FloatField(
+        default=0,
+        editable=False,
+        verbose_name='популярность за последние дни',
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='поисковый вектор',
+    )
 
     class Meta:
         verbose_name = 'Рецепт',
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date',)
+        indexes = [
+            models.Index(
+                fields=('-pub_date', '-id'),
+                name='recipes_pub_date_id_idx',
+            ),
+            models.Index(
+                fields=('author', '-pub_date', '-id'),
+                name='recipes_author_pub_date_idx',
+            ),
+            models.Index(
+                fields=('-favorites_count', '-pub_date', '-id'),
+                name='recipes_popular_idx',
+            ),
+            models.Index(
+                fields=('-trending_score', '-pub_date', '-id'),
+                name='recipes_trending_idx',
+            ),
+        ]
 
 
 class IngredientsInRecipes(models.Model):
@@ -143,6 +204,8 @@ class IngredientsInRecipes(models.Model):
 
 class Favorite(models.Model):
     '''Модель добавления в избранное'''
+    recipe_counter = 'favorites_count'
+
     user = models.ForeignKey(
         Users,
         on_delete=models.CASCADE,
@@ -153,6 +216,11 @@ class Favorite(models.Model):
         on_delete=models.CASCADE,
         related_name='favorites'
     )
+    created = models.DateTimeField(
+        default=timezone.now,
+        db_index=True,
+        verbose_name='дата добавления',
+    )
 
     class Meta:
         verbose_name = 'Избранное'
@@ -170,6 +238,8 @@ class Favorite(models.Model):
 
 class ShoppingCart(models.Model):
     '''Модель корзины'''
+    recipe_counter = 'shopping_cart_count'
+
     user = models.ForeignKey(
         Users,
         on_delete=models.CASCADE,
@@ -180,6 +250,11 @@ class ShoppingCart(models.Model):
         on_delete=models.CASCADE,
         related_name='shopping_cart'
     )
+    created = models.DateTimeField(
+        default=timezone.now,
+        db_index=True,
+        verbose_name='дата добавления',
+    )
 
     class Meta:
         verbose_name = 'Корзина покупок'
@@ -193,3 +268,323 @@ class ShoppingCart(models.Model):
 
     def __str__(self):
         return f'{self.user_id}{self.recipes_id}'
+
+
+class ShoppingCartIngredientManager(models.Manager):
+    '''Инкрементальное обновление сумм ингредиентов в корзинах'''
+
+    def apply_changes(self, users, changes):
+        '''Прибавляет к корзинам users изменения {ingredient_id: (amount,
+        количество рецептов)} двумя-тремя запросами на любое число строк.
+        '''
+        changes = {
+            ingredient_id: change for ingredient_id, change in changes.items()
+            if change != (0, 0)
+        }
+        if not changes:
+            return
+        if isinstance(users, models.QuerySet):
+            users = list(users)
+        users = [getattr(user, 'pk', user) for user in users]
+        if not users:
+            return
+        self.bulk_create(
+            [
+                self.model(user_id=user, ingredient_id=ingredient_id)
+                for user in users
+                for ingredient_id, (_, count) in changes.items()
+                if count > 0
+            ],
+            ignore_conflicts=True,
+        )
+        rows = self.filter(user__in=users, ingredient__in=changes)
+        rows.update(
+            amount=models.F('amount') + models.Case(
+                *(
+                    models.When(ingredient=ingredient_id, then=amount)
+                    for ingredient_id, (amount, _) in changes.items()
+                ),
+                output_field=models.FloatField(),
+            ),
+            recipes_count=models.F('recipes_count') + models.Case(
+                *(
+                    models.When(ingredient=ingredient_id, then=count)
+                    for ingredient_id, (_, count) in changes.items()
+                ),
+                output_field=models.IntegerField(),
+            ),
+        )
+        if any(count < 0 for _, count in changes.values()):
+            rows.filter(recipes_count__lte=0).delete()
+
+    def recipes_changes(self, recipes, sign=1):
+        changes = {}
+        rows = IngredientsInRecipes.objects.filter(
+            recipe__in=recipes
+        ).values_list('ingredient_id', 'amount')
+        for ingredient_id, amount in rows:
+            total, count = changes.get(ingredient_id, (0, 0))
+            changes[ingredient_id] = (total + sign * amount, count + sign)
+        return changes
+
+    def live_totals(self, users=None):
+        '''Суммы, посчитанные заново по корзинам и составу рецептов'''
+        rows = IngredientsInRecipes.objects.filter(
+            recipe__shopping_cart__isnull=False
+        )
+        if users is not None:
+            rows = rows.filter(recipe__shopping_cart__user__in=users)
+        return rows.values_list(
+            'recipe__shopping_cart__user', 'ingredient'
+        ).annotate(
+            total_amount=models.Sum('amount'),
+            total_recipes=models.Count('recipe'),
+        ).order_by()
+
+    def rebuild(self, users):
+        '''Пересчитывает корзины users целиком, двумя запросами'''
+        self.filter(user__in=users).delete()
+        self.bulk_create(
+            self.model(
+                user_id=user,
+                ingredient_id=ingredient,
+                amount=amount,
+                recipes_count=count,
+            )
+            for user, ingredient, amount, count in self.live_totals(users)
+        )
+
+    def add_recipes(self, user, recipes):
+        self.apply_changes([user], self.recipes_changes(recipes))
+
+    def remove_recipes(self, user, recipes):
+        self.apply_changes([user], self.recipes_changes(recipes, sign=-1))
+
+    def update_recipe(self, recipe, old_ingredients, new_ingredients):
+        '''Переносит изменение состава рецепта в корзины, где он лежит'''
+        changes = {}
+        for ingredient_id in old_ingredients.keys() | new_ingredients.keys():
+            old = old_ingredients.get(ingredient_id)
+            new = new_ingredients.get(ingredient_id)
+            changes[ingredient_id] = (
+                (new or 0) - (old or 0),
+                (new is not None) - (old is not None),
+            )
+        self.apply_changes(
+            ShoppingCart.objects.filter(
+                recipes=recipe
+            ).values_list('user_id', flat=True),
+            changes,
+        )
+
+
+class ShoppingCartIngredient(models.Model):
+    '''Сумма ингредиента по всем рецептам в корзине пользователя'''
+    user = models.ForeignKey(
+        Users,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_ingredients',
+    )
+    ingredient = models.ForeignKey(
+        Ingredients,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_ingredients',
+    )
+    amount = models.FloatField(
+        default=0,
+        verbose_name='количество ингредиента в корзине',
+    )
+    recipes_count = models.IntegerField(
+        default=0,
+        verbose_name='количество рецептов с ингредиентом в корзине',
+    )
+
+    objects = ShoppingCartIngredientManager()
+
+    class Meta:
+        verbose_name = 'Ингредиент в корзине'
+        verbose_name_plural = 'Ингредиенты в корзине'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_cart_ingredient',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} {self.ingredient_id}'
+
+
+class SimilarRecipe(models.Model):
+    '''Заранее посчитанный похожий рецепт'''
+    recipe = models.ForeignKey(
+        Recipes,
+        on_delete=models.CASCADE,
+        related_name='similar',
+    )
+    similar = models.ForeignKey(
+        Recipes,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+    score = models.FloatField(
+        verbose_name='близость',
+    )
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'similar'],
+                name='unique_similar_recipe',
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=('recipe', '-score'),
+                name='similar_recipe_score_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe_id} {self.similar_id}'
+
+
+FeedItem = namedtuple('FeedItem', ('pub_date', 'id'))
+
+
+class FeedEntryManager(models.Manager):
+    '''Ленты подписок: рецепты обычных авторов раскладываются по лентам
+    подписчиков при публикации, рецепты популярных читаются при выдаче.
+    '''
+
+    def followers(self, author_id):
+        '''Подписчики автора или None, если автор популярный'''
+        if Users.objects.filter(
+            pk=author_id, followers_count__gte=settings.FEED_FANOUT_LIMIT
+        ).exists():
+            return None
+        return list(Follow.objects.filter(
+            author_id=author_id
+        ).values_list('user_id', flat=True))
+
+    def popular_authors(self, user):
+        return Follow.objects.filter(
+            user=user,
+            author__followers_count__gte=settings.FEED_FANOUT_LIMIT,
+        ).values_list('author_id', flat=True)
+
+    def fan_out(self, recipe):
+        followers = self.followers(recipe.author_id)
+        if not followers:
+            return
+        self.bulk_create(
+            (
+                self.model(
+                    user_id=user_id,
+                    author_id=recipe.author_id,
+                    recipe_id=recipe.pk,
+                    pub_date=recipe.pub_date,
+                ) for user_id in followers
+            ),
+            batch_size=settings.FEED_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+
+    def follow(self, user, author_id):
+        '''Добавляет в ленту уже опубликованные рецепты автора'''
+        if self.followers(author_id) is None:
+            return
+        self.bulk_create(
+            (
+                self.model(
+                    user_id=getattr(user, 'pk', user),
+                    author_id=author_id,
+                    recipe_id=recipe_id,
+                    pub_date=pub_date,
+                ) for recipe_id, pub_date in Recipes.objects.filter(
+                    author_id=author_id
+                ).values_list('id', 'pub_date').iterator()
+            ),
+            batch_size=settings.FEED_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+
+    def unfollow(self, user, author_id):
+        self.filter(user=user, author_id=author_id).delete()
+
+    def page(self, user, position, size):
+        '''size записей ленты после position в порядке (-pub_date, -id)'''
+        popular = list(self.popular_authors(user))
+        timeline = self.filter(user=user)
+        if position is not None:
+            pub_date, recipe_id = position
+            timeline = timeline.filter(
+                models.Q(pub_date__lt=pub_date)
+                | models.Q(pub_date=pub_date, recipe_id__lt=recipe_id)
+            )
+        sources = [
+            timeline.exclude(author__in=popular).order_by(
+                '-pub_date', '-recipe_id'
+            ).values_list('pub_date', 'recipe_id')[:size]
+        ]
+        if popular:
+            recent = Recipes.objects.filter(author__in=popular)
+            if position is not None:
+                recent = recent.filter(
+                    models.Q(pub_date__lt=pub_date)
+                    | models.Q(pub_date=pub_date, id__lt=recipe_id)
+                )
+            sources.append(recent.order_by('-pub_date', '-id').values_list(
+                'pub_date', 'id'
+            )[:size])
+        items = heapq.merge(*sources, reverse=True)
+        return [FeedItem(*item) for _, item in zip(range(size), items)]
+
+
+class FeedEntry(models.Model):
+    '''Рецепт в ленте подписок пользователя'''
+    user = models.ForeignKey(
+        Users,
+        on_delete=models.CASCADE,
+        related_name='feed',
+    )
+    author = models.ForeignKey(
+        Users,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+    recipe = models.ForeignKey(
+        Recipes,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='дата создания рецепта',
+    )
+
+    objects = FeedEntryManager()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_entry',
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=('user', '-pub_date', '-recipe'),
+                name='feed_user_pub_date_idx',
+            ),
+            models.Index(
+                fields=('user', 'author'),
+                name='feed_user_author_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} {self.recipe_id}'
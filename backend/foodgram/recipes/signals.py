@@ -0,0 +1,61 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from users.models import Users
+from .models import (
+    FeedEntry, Favorite, Recipes, ShoppingCart, ShoppingCartIngredient,
+    change_counter
+)
+
+
+@receiver(pre_delete, sender=Recipes)
+def remove_recipe_from_shopping_carts(sender, instance, **kwargs):
+    '''Каскадное удаление корзин не проходит через views'''
+    ShoppingCartIngredient.objects.apply_changes(
+        ShoppingCart.objects.filter(
+            recipes=instance
+        ).values_list('user_id', flat=True),
+        ShoppingCartIngredient.objects.recipes_changes([instance], sign=-1),
+    )
+
+
+@receiver(post_save, sender=Recipes)
+def fan_out_recipe(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(partial(FeedEntry.objects.fan_out, instance))
+
+
+@receiver(post_save, sender=Recipes)
+def count_created_recipe(sender, instance, created, **kwargs):
+    if created:
+        change_counter(
+            Users.objects.filter(pk=instance.author_id), 'recipes_count', 1
+        )
+
+
+@receiver(post_delete, sender=Recipes)
+def count_deleted_recipe(sender, instance, **kwargs):
+    change_counter(
+        Users.objects.filter(pk=instance.author_id), 'recipes_count', -1
+    )
+
+
+@receiver(pre_delete, sender=Users)
+def uncount_deleted_user(sender, instance, **kwargs):
+    '''Избранное, корзины и подписки удаляются каскадом мимо views'''
+    for model in (Favorite, ShoppingCart):
+        change_counter(
+            Recipes.objects.filter(
+                pk__in=model.objects.filter(
+                    user=instance
+                ).values('recipes_id')
+            ),
+            model.recipe_counter,
+            -1,
+        )
+    change_counter(
+        Users.objects.filter(author__user=instance), 'followers_count', -1
+    )
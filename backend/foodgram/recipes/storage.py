@@ -0,0 +1,60 @@
+import hashlib
+import os
+import time
+import uuid
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    '''Хранит каждый файл один раз под именем из sha256 содержимого'''
+
+    def hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return '/'.join(filter(None, (
+            directory, digest[:2], digest[2:4], digest + extension
+        )))
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            # Свежее время изменения не даст сборщику мусора удалить
+            # файл, пока запись рецепта с ним ещё не закоммичена.
+            os.utime(self.path(name))
+            return name
+        # Пишем под временным именем и переименовываем: параллельная
+        # загрузка той же картинки не увидит недописанный файл.
+        temporary = super()._save(f'{name}.{uuid.uuid4().hex}.tmp', content)
+        os.replace(self.path(temporary), self.path(name))
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def is_fresh(self, name):
+        '''Файл недавно загружали, трогать его ещё рано'''
+        try:
+            modified = os.path.getmtime(self.path(name))
+        except FileNotFoundError:
+            return False
+        return time.time() - modified < settings.MEDIA_GC_GRACE_PERIOD
+
+    def delete_blob(self, name, renditions=()):
+        '''Удаляет файл вместе с его превью'''
+        for file_name in (name, *renditions):
+            self.delete(file_name)
+
+
+content_storage = ContentAddressedStorage()
@@ -0,0 +1,145 @@
+import io
+
+import pytest
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.authentication import token_cache
+from api.cache import membership_cache
+from recipes.models import Ingredients, IngredientsInRecipes, Recipes, Tags
+from users.models import Users
+
+
+def image_bytes():
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), (73, 182, 78)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def clear_caches():
+    caches[settings.DICTIONARY_CACHE].clear()
+    membership_cache.local.clear()
+    token_cache.local.clear()
+
+
+@pytest.fixture(autouse=True)
+def isolated_state(settings, tmp_path):
+    '''Кэши не переживают тест, файлы - во временной папке, превью
+    строятся сразу'''
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.IMAGE_PIPELINE_WORKERS = 0
+    clear_caches()
+    yield
+    clear_caches()
+
+
+@pytest.fixture
+def cold_caches():
+    '''Сбрасывает кэши посреди теста: запрос пойдёт мимо них'''
+    return clear_caches
+
+
+@pytest.fixture
+def make_user(db):
+    counter = iter(range(1000))
+
+    def make_user(**kwargs):
+        number = next(counter)
+        kwargs.setdefault('email', f'user{number}@example.com')
+        kwargs.setdefault('username', f'user{number}')
+        kwargs.setdefault('first_name', 'Имя')
+        kwargs.setdefault('last_name', 'Фамилия')
+        return Users.objects.create_user(password='pass12345!', **kwargs)
+
+    return make_user
+
+
+@pytest.fixture
+def user(make_user):
+    return make_user()
+
+
+@pytest.fixture
+def author(make_user):
+    return make_user()
+
+
+@pytest.fixture
+def tags(db):
+    return [
+        Tags.objects.create(
+            name=f'Тег {i}', color=f'#00000{i}', slug=f'tag{i}'
+        )
+        for i in range(3)
+    ]
+
+
+@pytest.fixture
+def ingredients(db):
+    return [
+        Ingredients.objects.create(name=name, measurement_unit=unit)
+        for name, unit in (
+            ('абрикос', 'г'), ('сахар', 'г'), ('соль', 'г'), ('молоко', 'мл'),
+        )
+    ]
+
+
+@pytest.fixture
+def make_recipe(author, tags, ingredients):
+    counter = iter(range(1000))
+
+    def make_recipe(recipe_author=None, **kwargs):
+        kwargs.setdefault('name', f'Рецепт {next(counter)}')
+        kwargs.setdefault('text', 'Описание')
+        kwargs.setdefault('cooking_time', 10)
+        recipe = Recipes.objects.create(
+            author=recipe_author or author,
+            image=ContentFile(image_bytes(), name='recipe.png'),
+            **kwargs,
+        )
+        recipe.tags.set(tags[:2])
+        IngredientsInRecipes.objects.bulk_create(
+            IngredientsInRecipes(
+                recipe=recipe, ingredient=ingredient, amount=1
+            )
+            for ingredient in ingredients[:3]
+        )
+        return recipe
+
+    return make_recipe
+
+
+@pytest.fixture
+def recipe(make_recipe):
+    return make_recipe()
+
+
+@pytest.fixture
+def make_client(db):
+    def make_client(user=None):
+        client = APIClient()
+        if user is not None:
+            token, _ = Token.objects.get_or_create(user=user)
+            client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return client
+
+    return make_client
+
+
+@pytest.fixture
+def client(make_client):
+    return make_client()
+
+
+@pytest.fixture
+def user_client(make_client, user):
+    return make_client(user)
+
+
+@pytest.fixture
+def author_client(make_client, author):
+    return make_client(author)
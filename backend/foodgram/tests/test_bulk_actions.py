@@ -0,0 +1,38 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from recipes.models import Favorite, Recipes, ShoppingCart
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('model, action', (
+    (Favorite, 'favorite'),
+    (ShoppingCart, 'shopping_cart'),
+))
+def test_bulk_add_inserts_once(user, user_client, make_recipe, model,
+                               action):
+    recipes = [make_recipe().pk for _ in range(3)]
+    model.objects.create(user=user, recipes_id=recipes[0])
+    Recipes.objects.filter(pk=recipes[0]).update(**{model.recipe_counter: 1})
+    with CaptureQueriesContext(connection) as context:
+        response = user_client.post(
+            f'/api/recipes/{action}/',
+            {'recipes': [*recipes, 999999]}, format='json',
+        )
+    assert response.status_code == 200
+    assert response.json() == [
+        {'id': recipes[0], 'status': 'exists'},
+        {'id': recipes[1], 'status': 'added'},
+        {'id': recipes[2], 'status': 'added'},
+        {'id': 999999, 'status': 'not_found'},
+    ]
+    table = connection.ops.quote_name(model._meta.db_table)
+    inserts = [
+        query['sql'] for query in context.captured_queries
+        if query['sql'].startswith('INSERT') and f'{table} (' in query['sql']
+    ]
+    assert len(inserts) == 1
+    assert dict(Recipes.objects.filter(pk__in=recipes).values_list(
+        'pk', model.recipe_counter
+    )) == {pk: 1 for pk in recipes}
@@ -0,0 +1,65 @@
+import threading
+from collections import Counter
+
+import pytest
+from django.db import connection
+
+from recipes.models import Favorite, Recipes, ShoppingCart
+from users.models import Follow
+
+# SQLite не ждёт блокировку, а сразу отвечает «database is locked»
+# второй пишущей транзакции: гонку проверяем на PostgreSQL.
+pytestmark = pytest.mark.skipif(
+    connection.vendor == 'sqlite',
+    reason='SQLite не пишет из двух транзакций одновременно',
+)
+
+
+def post_in_parallel(clients, path):
+    '''Одинаковые POST из разных потоков, стартующие одновременно'''
+    barrier = threading.Barrier(len(clients))
+    statuses = []
+
+    def post(client):
+        try:
+            barrier.wait()
+            statuses.append(client.post(path).status_code)
+        finally:
+            connection.close()
+
+    threads = [
+        threading.Thread(target=post, args=(client,)) for client in clients
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return Counter(statuses)
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('model, action', (
+    (Favorite, 'favorite'),
+    (ShoppingCart, 'shopping_cart'),
+))
+def test_parallel_recipe_additions(user, make_client, recipe, model, action):
+    statuses = post_in_parallel(
+        [make_client(user) for _ in range(2)],
+        f'/api/recipes/{recipe.pk}/{action}/',
+    )
+    assert statuses == {201: 1, 400: 1}
+    assert model.objects.filter(user=user, recipes=recipe).count() == 1
+    counter = Recipes.objects.values_list(
+        model.recipe_counter, flat=True
+    ).get(pk=recipe.pk)
+    assert counter == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_parallel_subscriptions(user, make_client, author):
+    statuses = post_in_parallel(
+        [make_client(user) for _ in range(2)],
+        f'/api/users/{author.pk}/subscribe/',
+    )
+    assert statuses == {201: 1, 400: 1}
+    assert Follow.objects.filter(user=user, author=author).count() == 1
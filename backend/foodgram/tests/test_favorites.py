@@ -0,0 +1,21 @@
+from unittest import mock
+
+import pytest
+from django.db import DatabaseError
+
+from recipes.models import Favorite, ShoppingCart
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('model, action', (
+    (Favorite, 'favorite'),
+    (ShoppingCart, 'shopping_cart'),
+))
+def test_failed_counter_rolls_back_addition(user, user_client, recipe,
+                                            model, action):
+    '''Строка и счётчик рецепта сохраняются только вместе'''
+    with mock.patch(
+        'api.views.change_counter', side_effect=DatabaseError
+    ), pytest.raises(DatabaseError):
+        user_client.post(f'/api/recipes/{recipe.pk}/{action}/')
+    assert not model.objects.filter(user=user, recipes=recipe).exists()
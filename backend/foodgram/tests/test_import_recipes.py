@@ -0,0 +1,52 @@
+import io
+import json
+
+import pytest
+from django.core.management import CommandError, call_command
+
+from recipes.models import Recipes
+
+
+@pytest.fixture
+def dataset(tmp_path, make_user):
+    '''Выгрузка с автором, чей username уже занят другой почтой'''
+    make_user(username='cook', email='cook@example.com')
+    records = [
+        {'type': 'user', 'email': 'other@example.com', 'username': 'cook',
+         'first_name': 'Имя', 'last_name': 'Фамилия'},
+        {'type': 'user', 'email': 'chef@example.com', 'username': 'chef',
+         'first_name': 'Имя', 'last_name': 'Фамилия'},
+    ] + [
+        {'type': 'recipe', 'name': f'Рецепт {author} {i}', 'author': author,
+         'text': 'Описание', 'cooking_time': 5,
+         'pub_date': '2023-01-01T00:00:00+00:00', 'image': '',
+         'tags': [], 'ingredients': []}
+        for author in ('other@example.com', 'chef@example.com')
+        for i in range(2)
+    ]
+    path = tmp_path / 'recipes.jsonl'
+    path.write_text(
+        '\n'.join(json.dumps(record) for record in records),
+        encoding='utf-8',
+    )
+    return str(path)
+
+
+@pytest.mark.django_db
+def test_username_conflict_fails_import(dataset):
+    with pytest.raises(CommandError, match='занятым username: 1'):
+        call_command('import_recipes', dataset, stdout=io.StringIO())
+    assert not Recipes.objects.exists()
+
+
+@pytest.mark.django_db
+def test_username_conflict_is_reported(dataset):
+    stderr = io.StringIO()
+    call_command(
+        'import_recipes', dataset, skip_conflicts=True,
+        stdout=io.StringIO(), stderr=stderr,
+    )
+    assert 'занятым username: 1, их рецептов: 2' in stderr.getvalue()
+    assert set(Recipes.objects.values_list('name', flat=True)) == {
+        'Рецепт chef@example.com 0', 'Рецепт chef@example.com 1',
+    }
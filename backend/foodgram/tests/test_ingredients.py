@@ -0,0 +1,29 @@
+import pytest
+
+from recipes.models import Ingredients
+
+
+@pytest.fixture
+def catalog(db, settings):
+    settings.INGREDIENT_SEARCH_LIMIT = 3
+    Ingredients.objects.bulk_create(
+        Ingredients(name=f'абрикос {i}', measurement_unit='г')
+        for i in range(5)
+    )
+
+
+@pytest.mark.parametrize('path', (
+    '/api/ingredients/', '/api/ingredients/?name=', '/api/ingredients/?name=+',
+))
+def test_empty_name_returns_catalog(client, catalog, path):
+    response = client.get(path)
+    assert response.status_code == 200
+    assert len(response.json()) == 5
+
+
+def test_name_search_is_capped(client, catalog):
+    response = client.get('/api/ingredients/?name=абрикос')
+    assert response.status_code == 200
+    assert [item['name'] for item in response.json()] == [
+        'абрикос 0', 'абрикос 1', 'абрикос 2',
+    ]
@@ -0,0 +1,81 @@
+import pytest
+
+from api.cache import membership_cache
+from recipes.models import Favorite, ShoppingCart
+from users.models import Follow
+
+
+@pytest.fixture
+def recipes(make_recipe, make_user):
+    return [make_recipe(make_user()) for _ in range(4)]
+
+
+@pytest.fixture
+def request_and_commit(user_client, django_capture_on_commit_callbacks):
+    '''Запрос от имени пользователя с выполнением колбэков on_commit,
+    в которых membership_cache правит свою копию'''
+    def request_and_commit(method, path, data=None):
+        with django_capture_on_commit_callbacks(execute=True):
+            response = getattr(user_client, method)(path, data, format='json')
+        assert response.status_code in (200, 201, 204), response.content
+        return response
+
+    return request_and_commit
+
+
+def assert_matches_database(user, client):
+    # Копия процесса должна быть поправлена на месте, а не перечитана:
+    # иначе сравнение с базой ничего не проверяет.
+    entry = membership_cache.local[user.pk]
+    assert entry[0] == membership_cache.get_version(user.pk)
+    expected = membership_cache.load(user.pk)
+    assert entry[2] == expected
+    for item in client.get('/api/recipes/?limit=10').json()['results']:
+        assert item['is_favorited'] == (item['id'] in expected[Favorite])
+        assert item['is_in_shopping_cart'] == (
+            item['id'] in expected[ShoppingCart]
+        )
+        assert item['author']['is_subscribed'] == (
+            item['author']['id'] in expected[Follow]
+        )
+
+
+@pytest.mark.django_db
+def test_memberships_follow_database(user, user_client, recipes,
+                                     request_and_commit):
+    first, second, third, fourth = (recipe.pk for recipe in recipes)
+    membership_cache.get(user.pk)
+    steps = (
+        ('post', f'/api/recipes/{first}/favorite/', None),
+        ('post', f'/api/recipes/{first}/shopping_cart/', None),
+        ('post', f'/api/users/{recipes[0].author_id}/subscribe/', None),
+        ('post', '/api/recipes/favorite/', {'recipes': [second, third]}),
+        ('post', '/api/recipes/shopping_cart/',
+         {'recipes': [first, second, fourth]}),
+        ('post', f'/api/users/{recipes[1].author_id}/subscribe/', None),
+        ('delete', f'/api/recipes/{first}/favorite/', None),
+        ('delete', '/api/recipes/favorite/', {'recipes': [second, fourth]}),
+        ('delete', f'/api/users/{recipes[0].author_id}/subscribe/', None),
+        ('delete', f'/api/recipes/{first}/shopping_cart/', None),
+        ('delete', '/api/recipes/shopping_cart/', {}),
+    )
+    for method, path, data in steps:
+        request_and_commit(method, path, data)
+        assert_matches_database(user, user_client)
+    assert membership_cache.load(user.pk) == {
+        Favorite: {third},
+        ShoppingCart: set(),
+        Follow: {recipes[1].author_id},
+    }
+
+
+@pytest.mark.django_db
+def test_foreign_change_drops_local_copy(user, recipes, request_and_commit):
+    '''Изменение из другого процесса: своя копия не годится, следующее
+    изменение перечитывает множества из базы'''
+    first, second = recipes[0].pk, recipes[1].pk
+    membership_cache.get(user.pk)
+    Favorite.objects.create(user=user, recipes_id=first)
+    membership_cache.cache.incr(membership_cache.version_key(user.pk))
+    request_and_commit('post', f'/api/recipes/{second}/favorite/')
+    assert membership_cache.get(user.pk)[Favorite] == {first, second}
@@ -0,0 +1,62 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from recipes.models import Favorite, ShoppingCart
+from users.models import Follow
+
+RECIPES_PATH = '/api/recipes/?limit=10'
+
+
+def count_queries(client, path):
+    with CaptureQueriesContext(connection) as context:
+        response = client.get(path)
+    assert response.status_code == 200
+    return len(context), response.json()
+
+
+@pytest.fixture
+def make_recipes(make_recipe, make_user, user):
+    '''Рецепты разных авторов: каждый в избранном, корзине и подписках
+    пользователя, чтобы флаги и авторы были у каждой карточки'''
+    def make_recipes(count):
+        for _ in range(count):
+            recipe_author = make_user()
+            recipe = make_recipe(recipe_author)
+            Favorite.objects.create(user=user, recipes=recipe)
+            ShoppingCart.objects.create(user=user, recipes=recipe)
+            Follow.objects.create(user=user, author=recipe_author)
+
+    return make_recipes
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('recipes', (1, 10))
+def test_anonymous_list_queries(make_recipes, client, cold_caches, recipes):
+    '''Число запросов не зависит от числа рецептов на странице'''
+    make_recipes(recipes)
+    cold_caches()
+    queries, data = count_queries(client, RECIPES_PATH)
+    assert len(data['results']) == recipes
+    # Количество, страница вместе с авторами, теги, ингредиенты.
+    assert queries == 4
+    queries, _ = count_queries(client, RECIPES_PATH)
+    assert queries == 0
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('recipes', (1, 10))
+def test_authenticated_list_queries(make_recipes, user_client, cold_caches,
+                                    recipes):
+    make_recipes(recipes)
+    cold_caches()
+    queries, data = count_queries(user_client, RECIPES_PATH)
+    assert len(data['results']) == recipes
+    assert all(
+        item['is_favorited'] and item['is_in_shopping_cart']
+        and item['author']['is_subscribed']
+        for item in data['results']
+    )
+    # Токен и множества избранного, корзины и подписок сверх запросов
+    # анонимной выдачи.
+    assert queries == 8
@@ -0,0 +1,67 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from api.cache import recipe_cache
+
+WRITES = ('INSERT', 'UPDATE', 'DELETE')
+
+
+def recipe_payload(data):
+    '''Тело PATCH из ответа API: те же значения, что уже сохранены'''
+    return {
+        'name': data['name'],
+        'text': data['text'],
+        'cooking_time': data['cooking_time'],
+        'tags': [tag['id'] for tag in data['tags']],
+        'ingredients': [
+            {'id': item['id'], 'amount': item['amount']}
+            for item in data['ingredients']
+        ],
+    }
+
+
+def patch(client, recipe, payload, capture_on_commit):
+    '''PATCH с выполнением колбэков on_commit, возвращает записи в базу'''
+    with CaptureQueriesContext(connection) as context:
+        with capture_on_commit(execute=True):
+            response = client.patch(
+                f'/api/recipes/{recipe.pk}/', payload, format='json'
+            )
+    assert response.status_code == 200
+    return [
+        query['sql'] for query in context.captured_queries
+        if query['sql'].lstrip().upper().startswith(WRITES)
+    ]
+
+
+@pytest.mark.django_db
+def test_unchanged_patch_writes_nothing(author_client, recipe,
+                                        django_capture_on_commit_callbacks):
+    payload = recipe_payload(
+        author_client.get(f'/api/recipes/{recipe.pk}/').json()
+    )
+    versions = recipe_cache.versions(('content', f'recipe:{recipe.pk}'))
+    writes = patch(
+        author_client, recipe, payload, django_capture_on_commit_callbacks
+    )
+    assert writes == []
+    # Кэш выдачи рецептов не сбрасывается.
+    assert recipe_cache.versions(
+        ('content', f'recipe:{recipe.pk}')
+    ) == versions
+
+
+@pytest.mark.django_db
+def test_changed_amount_is_written(author_client, recipe,
+                                   django_capture_on_commit_callbacks):
+    payload = recipe_payload(
+        author_client.get(f'/api/recipes/{recipe.pk}/').json()
+    )
+    payload['ingredients'][0]['amount'] += 1
+    versions = recipe_cache.versions(('content',))
+    writes = patch(
+        author_client, recipe, payload, django_capture_on_commit_callbacks
+    )
+    assert writes
+    assert recipe_cache.versions(('content',)) != versions
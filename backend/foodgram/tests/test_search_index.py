@@ -0,0 +1,38 @@
+import pytest
+from django.db import transaction
+
+from api.search import get_search_backend, inverted_index_search
+
+
+class Rollback(Exception):
+    pass
+
+
+@pytest.fixture
+def index(db):
+    if get_search_backend() is not inverted_index_search:
+        pytest.skip('Индекс в памяти используется только без PostgreSQL')
+    # Версия в общем кэше есть: свои изменения индекс применяет на месте,
+    # а не пересобирает из базы.
+    inverted_index_search.bump_version()
+    inverted_index_search.refresh()
+    return inverted_index_search
+
+
+def test_committed_recipe_is_indexed(index, make_recipe,
+                                     django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks(execute=True):
+        recipe = make_recipe(name='Шарлотка')
+    assert recipe.pk in index.rank('шарлотка')
+    with django_capture_on_commit_callbacks(execute=True):
+        recipe.delete()
+    assert index.rank('шарлотка') == {}
+
+
+def test_rolled_back_recipe_is_not_indexed(index, make_recipe,
+                                           django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks(execute=True):
+        with pytest.raises(Rollback), transaction.atomic():
+            make_recipe(name='Шарлотка')
+            raise Rollback
+    assert index.rank('шарлотка') == {}
@@ -0,0 +1,34 @@
+import pytest
+
+from api.renderers import ShoppingListRenderer
+from recipes.models import ShoppingCartIngredient
+
+
+@pytest.mark.parametrize('amount, expected', (
+    (1000000.0, '1000000'),
+    (123456789.0, '123456789'),
+    (1234567.5, '1234567.5'),
+    (2.25, '2.25'),
+    (3.0, '3'),
+))
+def test_format_amount(amount, expected):
+    assert ShoppingListRenderer().format_amount(amount) == expected
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('file_format, line', (
+    ('txt', 'абрикос (г) - 1000000'),
+    ('csv', 'абрикос,г,1000000'),
+))
+def test_large_total_in_download(user, user_client, ingredients,
+                                 file_format, line):
+    ShoppingCartIngredient.objects.create(
+        user=user, ingredient=ingredients[0], amount=1000000,
+        recipes_count=1,
+    )
+    response = user_client.get(
+        f'/api/recipes/download_shopping_cart/?format={file_format}'
+    )
+    assert response.status_code == 200
+    content = b''.join(response.streaming_content).decode()
+    assert line in content.splitlines()
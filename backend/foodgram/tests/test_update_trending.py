@@ -0,0 +1,25 @@
+import io
+
+import pytest
+from django.core.management import call_command
+
+from recipes.models import Favorite, Recipes
+
+
+def update_trending():
+    out = io.StringIO()
+    call_command('update_trending', stdout=out)
+    return out.getvalue()
+
+
+@pytest.mark.django_db
+def test_only_changed_scores_are_written(make_user, make_recipe):
+    first, second = make_recipe(), make_recipe()
+    Favorite.objects.create(user=make_user(), recipes=first)
+    assert 'записано: 1, обнулено: 0' in update_trending()
+    assert 'записано: 0, обнулено: 0' in update_trending()
+    Favorite.objects.create(user=make_user(), recipes=second)
+    assert 'записано: 1, обнулено: 0' in update_trending()
+    Favorite.objects.all().delete()
+    assert 'записано: 0, обнулено: 2' in update_trending()
+    assert not Recipes.objects.filter(trending_score__gt=0).exists()
@@ -5,6 +5,7 @@ from .models import Users
 
 @admin.register(Users)
 class UsersAdmin(admin.ModelAdmin):
+    list_display = ('username', 'email', 'recipes_count', 'followers_count',)
     list_filter = ('username', 'email',)
     search_fields = (
         'id', 'username', 'password',
@@ -14,6 +14,16 @@ class Users(AbstractUser):
     confirmation_code = models.CharField(
         max_length=255, blank=True, null=True
     )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='количество подписчиков',
+    )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='количество рецептов',
+    )
 
     @property
     def is_admin(self):